@@ -311,6 +311,11 @@ async def shutdown(dispatcher: Dispatcher, bot_instance: Bot, web_runner=None):
             logging.warning("Background tasks cancellation timed out.")
         except Exception as e:
             logging.error(f"Error during tasks cancellation: {e}")
+    try:
+        flushed = await asyncio.wait_for(nodes_db.flush_heartbeats(), timeout=5.0)
+        logging.info(f"Flushed buffered heartbeats of {flushed} nodes.")
+    except Exception as e:
+        logging.error(f"Heartbeat flush on shutdown failed: {e}")
     logging.info("Closing DB connections...")
     try:
         await asyncio.wait_for(Tortoise.close_connections(), timeout=5.0)
@@ -327,6 +332,7 @@ async def main():
     try:
         logging.info(f"Bot starting in mode: {config.INSTALL_MODE.upper()}")
         await nodes_db.init_db()
+        background_tasks.update(nodes_db.start_background_tasks())
         await asyncio.to_thread(auth.load_users)
         await asyncio.to_thread(utils.load_alerts_config)
         await asyncio.to_thread(utils.load_services_config)
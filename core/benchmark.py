@@ -0,0 +1,427 @@
+import os
+import time
+import asyncio
+import random
+import shutil
+import resource
+import tempfile
+from tortoise import Tortoise
+from . import nodes_db
+from .models import Node
+
+SAMPLE_STATS = {
+    "cpu": 12.5,
+    "ram": 43.1,
+    "disk": 61.0,
+    "ram_total": 2084327424,
+    "ram_free": 1183252480,
+    "disk_total": 42140401664,
+    "disk_free": 16434393088,
+    "cpu_freq": 2394.45,
+    "net_rx": 987654321,
+    "net_tx": 123456789,
+    "uptime": 864000,
+    "process_cpu": "python3 (3.1%), xray (1.2%), sshd (0.4%)",
+    "process_ram": "xray (9.8%), python3 (4.2%), systemd (0.7%)",
+    "external_ip": "203.0.113.10",
+}
+
+
+def _bytes_written() -> int:
+    """Bytes passed to write() by this process, including the SQLite WAL."""
+    try:
+        with open("/proc/self/io", "r") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def _peak_rss_kb() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _db_size(db_path: str) -> int:
+    size = 0
+    for suffix in ("", "-wal", "-shm"):
+        try:
+            size += os.path.getsize(db_path + suffix)
+        except OSError:
+            pass
+    return size
+
+
+def _percentile(samples: list, fraction: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def _open_temp_db():
+    tmp_dir = tempfile.mkdtemp(prefix="nodes_bench_")
+    db_path = os.path.join(tmp_dir, "nodes.db")
+    await nodes_db.init_db(db_path=db_path)
+    return tmp_dir, db_path
+
+
+async def _close_temp_db(tmp_dir: str):
+    await Tortoise.close_connections()
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+async def _measure(name: str, ops: int, func) -> dict:
+    written = _bytes_written()
+    started = time.perf_counter()
+    await func()
+    elapsed = time.perf_counter() - started
+    written = _bytes_written() - written
+    return {
+        "name": name,
+        "ops": ops,
+        "bytes_written": written,
+        "bytes_per_op": round(written / ops, 1),
+        "ms_per_op": round(elapsed * 1000 / ops, 3),
+    }
+
+
+async def bench_writes(nodes: int = 100, rounds: int = 20) -> dict:
+    """Compares full-row Node.save() with the column-targeted UPDATEs used
+    by nodes_db for heartbeat and extra-state writes."""
+    tmp_dir, _ = await _open_temp_db()
+    try:
+        tokens = [await nodes_db.create_node(f"bench-{i}") for i in range(nodes)]
+        hashes = [nodes_db._get_token_hash(t) for t in tokens]
+        ops = nodes * rounds
+
+        async def heartbeat_full_save():
+            for _ in range(rounds):
+                for t_hash in hashes:
+                    node = await Node.get(token_hash=t_hash)
+                    node.last_seen = time.time()
+                    node.stats = SAMPLE_STATS
+                    await node.save()
+
+        async def heartbeat_targeted():
+            for _ in range(rounds):
+                for t_hash in hashes:
+                    await Node.filter(token_hash=t_hash).update(
+                        last_seen=time.time(), stats=SAMPLE_STATS
+                    )
+
+        async def extra_full_save():
+            for i in range(rounds):
+                for t_hash in hashes:
+                    node = await Node.get(token_hash=t_hash)
+                    node.extra_state = {**node.extra_state, "is_restarting": i % 2 == 0}
+                    await node.save()
+
+        async def extra_targeted():
+            for i in range(rounds):
+                for token in tokens:
+                    await nodes_db.update_node_extra(token, "is_restarting", i % 2 == 0)
+
+        results = [
+            await _measure("heartbeat_full_save", ops, heartbeat_full_save),
+            await _measure("heartbeat_targeted_update", ops, heartbeat_targeted),
+            await _measure("extra_full_save", ops, extra_full_save),
+            await _measure("extra_targeted_update", ops, extra_targeted),
+        ]
+        by_name = {r["name"]: r for r in results}
+        summary = {}
+        for kind in ("heartbeat", "extra"):
+            full = by_name[f"{kind}_full_save"]["bytes_per_op"]
+            targeted = by_name[f"{kind}_targeted_update"]["bytes_per_op"]
+            summary[f"{kind}_write_reduction"] = (
+                round(1 - targeted / full, 3) if full else None
+            )
+        return {
+            "suite": "writes",
+            "nodes": nodes,
+            "rounds": rounds,
+            "results": results,
+            "summary": summary,
+        }
+    finally:
+        await _close_temp_db(tmp_dir)
+
+
+async def _timed(name: str, calls) -> dict:
+    """Awaits every coroutine factory in calls one by one and reports
+    throughput and latency percentiles of the individual calls."""
+    latencies = []
+    started = time.perf_counter()
+    for call in calls:
+        t0 = time.perf_counter()
+        await call()
+        latencies.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - started
+    return {
+        "name": name,
+        "ops": len(latencies),
+        "ops_per_sec": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50_ms": round(_percentile(latencies, 0.5) * 1000, 3),
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 3),
+        "max_ms": round(max(latencies, default=0) * 1000, 3),
+        "peak_rss_kb": _peak_rss_kb(),
+    }
+
+
+async def bench_storage(nodes: int = 1000, rounds: int = 5) -> dict:
+    """Drives the nodes_db API the way a fleet of `nodes` agents and the
+    web UI do: one heartbeat per node and round (flushed like the
+    background flusher would), full-list reads, token lookups and task
+    writes. Reports throughput, p50/p99, DB file growth and peak RSS."""
+    tmp_dir, db_path = await _open_temp_db()
+    rng = random.Random(42)
+    try:
+        size_empty = _db_size(db_path)
+        results = []
+        tokens = []
+
+        async def create(i):
+            tokens.append(await nodes_db.create_node(f"bench-{i}"))
+
+        results.append(
+            await _timed(
+                "create_node", [lambda i=i: create(i) for i in range(nodes)]
+            )
+        )
+        size_created = _db_size(db_path)
+
+        def heartbeat(token):
+            stats = {
+                **SAMPLE_STATS,
+                "cpu": round(rng.uniform(0, 100), 1),
+                "ram": round(rng.uniform(0, 100), 1),
+            }
+            return nodes_db.update_node_heartbeat(token, "203.0.113.10", stats)
+
+        heartbeat_results = []
+        flush_results = []
+        for _ in range(rounds):
+            heartbeat_results.append(
+                await _timed(
+                    "update_node_heartbeat",
+                    [lambda t=t: heartbeat(t) for t in tokens],
+                )
+            )
+            flush_results.append(
+                await _timed("flush_heartbeats", [nodes_db.flush_heartbeats])
+            )
+        results.append(_merge_rounds(heartbeat_results))
+        results.append(_merge_rounds(flush_results))
+
+        list_rounds = max(3, rounds)
+        results.append(
+            await _timed("get_all_nodes", [nodes_db.get_all_nodes] * list_rounds)
+        )
+        results.append(
+            await _timed(
+                "get_nodes_summary", [nodes_db.get_nodes_summary] * list_rounds
+            )
+        )
+
+        lookups = [rng.choice(tokens) for _ in range(nodes)]
+        results.append(
+            await _timed(
+                "get_node_by_token",
+                [lambda t=t: nodes_db.get_node_by_token(t) for t in lookups],
+            )
+        )
+        task = {"command": "traffic"}
+        results.append(
+            await _timed(
+                "update_node_task",
+                [lambda t=t: nodes_db.update_node_task(t, task) for t in lookups],
+            )
+        )
+        results.append(
+            await _timed(
+                "take_node_tasks",
+                [lambda t=t: nodes_db.take_node_tasks(t, []) for t in tokens],
+            )
+        )
+        size_final = _db_size(db_path)
+        return {
+            "suite": "storage",
+            "nodes": nodes,
+            "rounds": rounds,
+            "results": results,
+            "db_bytes": {
+                "empty": size_empty,
+                "after_create": size_created,
+                "final": size_final,
+                "per_node": round((size_final - size_empty) / nodes, 1),
+            },
+            "peak_rss_kb": _peak_rss_kb(),
+            "cache": nodes_db.get_cache_stats(),
+        }
+    finally:
+        nodes_db._HEARTBEAT_BUFFER.clear()
+        await _close_temp_db(tmp_dir)
+
+
+def _merge_rounds(rounds: list) -> dict:
+    """Folds per-round _timed() results into one entry. Percentiles are
+    the worst round's, throughput is over all rounds."""
+    ops = sum(r["ops"] for r in rounds)
+    seconds = sum(r["ops"] / r["ops_per_sec"] for r in rounds if r["ops_per_sec"])
+    return {
+        "name": rounds[0]["name"],
+        "ops": ops,
+        "ops_per_sec": round(ops / seconds, 1) if seconds else None,
+        "p50_ms": max(r["p50_ms"] for r in rounds),
+        "p99_ms": max(r["p99_ms"] for r in rounds),
+        "max_ms": max(r["max_ms"] for r in rounds),
+        "peak_rss_kb": rounds[-1]["peak_rss_kb"],
+    }
+
+
+async def _baseline_heartbeat(token: str, ip: str, stats: dict, acks: list):
+    """The storage path handle_heartbeat had before ingest_heartbeat,
+    replayed on the Node model directly so none of the nodes_db caches or
+    the write buffer are involved: every step re-reads the full row and
+    saves it back, history and tasks live in the row's JSON columns."""
+    t_hash = nodes_db._get_token_hash(token)
+    node = await Node.get_or_none(token_hash=t_hash)
+    if not node:
+        return None, []
+    if (node.extra_state or {}).get("is_restarting"):
+        node = await Node.get(token_hash=t_hash)
+        node.extra_state = {**node.extra_state, "is_restarting": False}
+        await node.save()
+    node = await Node.get(token_hash=t_hash)
+    history = node.history or []
+    history.append({
+        "t": int(time.time()),
+        "c": stats.get("cpu", 0),
+        "r": stats.get("ram", 0),
+        "rx": stats.get("net_rx", 0),
+        "tx": stats.get("net_tx", 0),
+    })
+    node.last_seen = time.time()
+    node.ip = ip
+    node.stats = stats
+    node.history = history[-60:]
+    await node.save()
+    node = await Node.get(token_hash=t_hash)
+    tasks = node.tasks or []
+    if tasks:
+        node = await Node.get(token_hash=t_hash)
+        node.tasks = []
+        await node.save()
+    return node, tasks
+
+
+async def _prepare_baseline(tokens: list, task: dict):
+    for token in tokens:
+        await Node.filter(token_hash=nodes_db._get_token_hash(token)).update(
+            extra_state={"is_restarting": True}, tasks=[task]
+        )
+
+
+async def _prepare_ingest(tokens: list, task: dict):
+    for token in tokens:
+        await nodes_db.update_node_extra(token, "is_restarting", True)
+        await nodes_db.update_node_task(token, task)
+
+
+async def _load(tokens: list, rounds: int, concurrency: int, ingest) -> dict:
+    """Sends rounds heartbeats per node from `concurrency` parallel clients
+    and reports requests per second and latency percentiles."""
+    queue = asyncio.Queue()
+    for _ in range(rounds):
+        for token in tokens:
+            queue.put_nowait(token)
+    latencies = []
+
+    async def client():
+        while not queue.empty():
+            token = queue.get_nowait()
+            t0 = time.perf_counter()
+            await ingest(token, "203.0.113.10", SAMPLE_STATS, [])
+            latencies.append(time.perf_counter() - t0)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    await nodes_db.flush_heartbeats()
+    elapsed = time.perf_counter() - started
+    return {
+        "ops": len(latencies),
+        "ops_per_sec": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(_percentile(latencies, 0.5) * 1000, 3),
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 3),
+    }
+
+
+async def bench_ingest(
+    nodes: int = 1000, rounds: int = 5, concurrency: int = 50
+) -> dict:
+    """Load test of the heartbeat storage path: the original full-row
+    read/save sequence (before) against nodes_db.ingest_heartbeat (after).
+    A tenth of the nodes carry the restarting flag and a pending task."""
+    tmp_dir, _ = await _open_temp_db()
+    try:
+        tokens = [await nodes_db.create_node(f"bench-{i}") for i in range(nodes)]
+        busy = tokens[::10]
+        report = {
+            "suite": "ingest",
+            "nodes": nodes,
+            "rounds": rounds,
+            "concurrency": concurrency,
+            "results": [],
+        }
+        task = {"command": "traffic"}
+        for name, prepare, ingest in (
+            ("before", _prepare_baseline, _baseline_heartbeat),
+            ("after", _prepare_ingest, nodes_db.ingest_heartbeat),
+        ):
+            await prepare(busy, task)
+            result = await _load(tokens, rounds, concurrency, ingest)
+            report["results"].append({"name": name, **result})
+        before, after = report["results"]
+        report["summary"] = {
+            "speedup": round(after["ops_per_sec"] / before["ops_per_sec"], 2)
+        }
+        return report
+    finally:
+        nodes_db._HEARTBEAT_BUFFER.clear()
+        await _close_temp_db(tmp_dir)
+
+
+def compare(report: dict, baseline: dict, tolerance: float = 0.2) -> list:
+    """Lists operations whose p99 grew or throughput dropped by more than
+    tolerance against a previously saved report of the same suite."""
+    previous = {r["name"]: r for r in baseline.get("results", [])}
+    regressions = []
+    for result in report.get("results", []):
+        old = previous.get(result["name"])
+        if not old:
+            continue
+        if old.get("p99_ms") and result["p99_ms"] > old["p99_ms"] * (1 + tolerance):
+            regressions.append(
+                f"{result['name']}: p99 {old['p99_ms']} -> {result['p99_ms']} ms"
+            )
+        if old.get("ops_per_sec") and (result["ops_per_sec"] or 0) < old[
+            "ops_per_sec"
+        ] * (1 - tolerance):
+            regressions.append(
+                f"{result['name']}: {old['ops_per_sec']} -> {result['ops_per_sec']} ops/s"
+            )
+    return regressions
+
+
+SUITES = {
+    "writes": bench_writes,
+    "storage": bench_storage,
+    "ingest": bench_ingest,
+}
+
+
+async def run(suite: str, **kwargs) -> dict:
+    kwargs = {k: v for k, v in kwargs.items() if v is not None}
+    return await SUITES[suite](**kwargs)
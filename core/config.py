@@ -336,9 +336,71 @@ def setup_logging(log_directory, log_filename_prefix):
 
 
 SENTRY_DSN = os.environ.get("SENTRY_DSN")
-DB_URL = f"sqlite://{os.path.join(CONFIG_DIR, 'nodes.db')}"
+NODES_DB_PATH = os.path.join(CONFIG_DIR, "nodes.db")
+DB_URL = f"sqlite://{NODES_DB_PATH}"
+# PRAGMAs applied to every nodes.db connection. "performance" trades the
+# last few committed transactions on power loss (never corruption, thanks
+# to WAL) for far fewer fsyncs; "safe" keeps full sync; "off" leaves the
+# Tortoise defaults.
+SQLITE_PROFILES = {
+    "performance": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 64 * 1024 * 1024,
+        "cache_size": -16000,
+        "busy_timeout": 5000,
+        "temp_store": "MEMORY",
+        "auto_vacuum": "INCREMENTAL",
+    },
+    "safe": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "busy_timeout": 5000,
+        "auto_vacuum": "INCREMENTAL",
+    },
+    "off": {},
+}
+NODES_DB_PROFILE = os.environ.get("NODES_DB_PROFILE", "performance")
+SQLITE_PRAGMAS = SQLITE_PROFILES.get(NODES_DB_PROFILE, SQLITE_PROFILES["performance"])
+# Heartbeats are buffered in memory and written to nodes.db in batches.
+# A flush happens every NODES_DB_FLUSH_INTERVAL seconds or as soon as
+# NODES_DB_MAX_PENDING heartbeats are buffered, whichever comes first;
+# together they bound what a crash can lose.
+NODES_DB_FLUSH_INTERVAL = float(os.environ.get("NODES_DB_FLUSH_INTERVAL", 5))
+NODES_DB_MAX_PENDING = int(os.environ.get("NODES_DB_MAX_PENDING", 1000))
+# Number of decoded node records kept by nodes_db.get_node_by_token.
+NODES_DB_CACHE_SIZE = int(os.environ.get("NODES_DB_CACHE_SIZE", 1024))
+# Heartbeat interval hints sent to nodes (next_interval_ms), by node state.
+# Under load above HEARTBEAT_TARGET_RATE heartbeats/s the non-watched
+# intervals are stretched, but never past half of NODE_OFFLINE_TIMEOUT.
+HEARTBEAT_WATCHED_INTERVAL_MS = int(os.environ.get("HEARTBEAT_WATCHED_INTERVAL_MS", 2000))
+HEARTBEAT_ALERT_INTERVAL_MS = int(os.environ.get("HEARTBEAT_ALERT_INTERVAL_MS", 5000))
+HEARTBEAT_IDLE_INTERVAL_MS = int(os.environ.get("HEARTBEAT_IDLE_INTERVAL_MS", 8000))
+HEARTBEAT_TARGET_RATE = float(os.environ.get("HEARTBEAT_TARGET_RATE", 200))
+HEARTBEAT_JITTER = float(os.environ.get("HEARTBEAT_JITTER", 0.1))
+# Pre-authentication limits for /api/heartbeat (core/heartbeat_guard.py).
+HEARTBEAT_MAX_BODY = int(os.environ.get("HEARTBEAT_MAX_BODY", 256 * 1024))
+HEARTBEAT_MAX_SKEW = int(os.environ.get("HEARTBEAT_MAX_SKEW", 300))
+HEARTBEAT_TOKEN_RATE = float(os.environ.get("HEARTBEAT_TOKEN_RATE", 2))
+HEARTBEAT_TOKEN_BURST = int(os.environ.get("HEARTBEAT_TOKEN_BURST", 10))
+HEARTBEAT_IP_RATE = float(os.environ.get("HEARTBEAT_IP_RATE", 50))
+HEARTBEAT_IP_BURST = int(os.environ.get("HEARTBEAT_IP_BURST", 200))
+# External IP discovery (ip_resolver.py). EXTERNAL_IP pins the address for
+# the "static" heuristic; heuristics run in order before the HTTP services.
+EXTERNAL_IP = os.environ.get("EXTERNAL_IP", "")
+EXTERNAL_IP_TTL = int(os.environ.get("EXTERNAL_IP_TTL", 3600))
+EXTERNAL_IP_HEURISTICS = os.environ.get("EXTERNAL_IP_HEURISTICS", "static,interfaces,route")
+
+
+def sqlite_connection(file_path: str) -> dict:
+    return {
+        "engine": "tortoise.backends.sqlite",
+        "credentials": {"file_path": file_path, **SQLITE_PRAGMAS},
+    }
+
+
 TORTOISE_ORM = {
-    "connections": {"default": DB_URL},
+    "connections": {"default": sqlite_connection(NODES_DB_PATH)},
     "apps": {
         "models": {
             "models": ["core.models", "aerich.models"],
@@ -0,0 +1,111 @@
+import time
+import hashlib
+from collections import Counter, OrderedDict
+from . import nodes_db
+from .config import (
+    HEARTBEAT_MAX_BODY,
+    HEARTBEAT_MAX_SKEW,
+    HEARTBEAT_TOKEN_RATE,
+    HEARTBEAT_TOKEN_BURST,
+    HEARTBEAT_IP_RATE,
+    HEARTBEAT_IP_BURST,
+)
+
+# Cheap checks run on /api/heartbeat before the body is decoded or SQLite
+# is touched. Nodes send X-Node-Id (sha256 of the token) and X-Timestamp;
+# both are checked again against the signed body after the HMAC passes.
+# Older nodes without these headers only go through the size cap and
+# the per-IP bucket.
+
+DROPS = Counter()
+_IP_BUCKETS = OrderedDict()
+_TOKEN_BUCKETS = OrderedDict()
+_MAX_BUCKETS = 10000
+# token_hash -> signatures accepted within the freshness window (signature
+# -> body timestamp) and a floor: timestamps at or below it are rejected.
+# When a node exceeds _RECENT_SIGNATURES_SIZE, the oldest signature is
+# evicted and the floor rises to its timestamp, so a replay can never
+# outlive its record.
+_RECENT_SIGNATURES = {}
+_RECENT_SIGNATURES_SIZE = 1024
+
+
+def _take(buckets: OrderedDict, key: str, rate: float, burst: int, now: float) -> bool:
+    tokens, last = buckets.get(key, (burst, now))
+    tokens = min(burst, tokens + (now - last) * rate)
+    allowed = tokens >= 1
+    buckets[key] = (tokens - 1 if allowed else tokens, now)
+    buckets.move_to_end(key)
+    if len(buckets) > _MAX_BUCKETS:
+        buckets.popitem(last=False)
+    return allowed
+
+
+def _drop(reason: str, status: int, message: str):
+    DROPS[reason] += 1
+    return status, message
+
+
+async def precheck(request, client_ip: str):
+    """Returns None to go on, or (status, error) to reject right away."""
+    now = time.time()
+    if request.content_length is not None and request.content_length > HEARTBEAT_MAX_BODY:
+        return _drop("too_large", 413, "Body too large")
+    if not _take(_IP_BUCKETS, client_ip, HEARTBEAT_IP_RATE, HEARTBEAT_IP_BURST, now):
+        return _drop("ip_rate", 429, "Too many requests")
+    node_id = request.headers.get("X-Node-Id")
+    if node_id is None:
+        return None
+    if node_id not in await nodes_db.get_known_token_hashes():
+        return _drop("unknown_token", 401, "Auth fail")
+    try:
+        timestamp = float(request.headers.get("X-Timestamp", ""))
+    except ValueError:
+        return _drop("stale", 401, "Timestamp missing")
+    if abs(now - timestamp) > HEARTBEAT_MAX_SKEW:
+        return _drop("stale", 401, "Stale timestamp")
+    if not _take(
+        _TOKEN_BUCKETS, node_id, HEARTBEAT_TOKEN_RATE, HEARTBEAT_TOKEN_BURST, now
+    ):
+        return _drop("token_rate", 429, "Too many requests")
+    return None
+
+
+def body_too_large(body: bytes):
+    if len(body) > HEARTBEAT_MAX_BODY:
+        return _drop("too_large", 413, "Body too large")
+    return None
+
+
+def postcheck(request, token: str, data: dict, signature: str):
+    """Runs after the HMAC check: the pre-check headers must match the
+    signed body, the signed timestamp must be fresh, and a signature
+    already accepted within the freshness window is a replay."""
+    t_hash = hashlib.sha256(token.encode()).hexdigest()
+    node_id = request.headers.get("X-Node-Id")
+    timestamp = data.get("timestamp")
+    if node_id is not None:
+        if node_id != t_hash or request.headers.get("X-Timestamp") != str(timestamp):
+            return _drop("header_mismatch", 401, "Auth fail")
+    now = time.time()
+    if not isinstance(timestamp, (int, float)) or abs(now - timestamp) > HEARTBEAT_MAX_SKEW:
+        return _drop("stale", 401, "Stale timestamp")
+    recent = _RECENT_SIGNATURES.setdefault(t_hash, {"seen": OrderedDict(), "floor": 0})
+    seen = recent["seen"]
+    if timestamp <= recent["floor"] or signature in seen:
+        return _drop("replay", 409, "Replayed heartbeat")
+    while seen and next(iter(seen.values())) < now - HEARTBEAT_MAX_SKEW:
+        seen.popitem(last=False)
+    seen[signature] = timestamp
+    if len(seen) > _RECENT_SIGNATURES_SIZE:
+        _, evicted = seen.popitem(last=False)
+        recent["floor"] = max(recent["floor"], evicted)
+    return None
+
+
+def get_stats() -> dict:
+    return {
+        "drops": dict(DROPS),
+        "tracked_ips": len(_IP_BUCKETS),
+        "tracked_tokens": len(_TOKEN_BUCKETS),
+    }
@@ -331,8 +331,13 @@ STRINGS = {
         "node_restarting_alert": "🔵 Сервер '{name}' перезагружается. Пожалуйста, подождите 1-2 минуты.",
         "node_management_menu": "🟢 <b>Управление сервером: {name}</b>\nIP: {ip}\nUptime: {uptime}\n\nВыберите действие:",
         "node_cmd_sent": "Команда '{cmd}' отправлена на сервер '{name}'.",
+        "node_cmd_running": "⏳ Команда '{cmd}' всё ещё выполняется ({elapsed} с)...",
         "node_btn_add": "➕ Добавить Ноду",
         "node_btn_delete": "➖ Удалить Ноду",
+        "nodes_view_all": "Все",
+        "nodes_view_online": "🟢 В сети",
+        "nodes_view_offline": "🔴 Не в сети",
+        "nodes_view_cpu": "🔥 CPU",
         "node_add_success_token": "✅ <b>Нода создана!</b>\n\nИмя: <b>{name}</b>\nТокен: <code>{token}</code>\n\n<b>Команда для установки:</b>\n<pre><code class='language-bash'>{command}</code></pre>\n\n<i>Вставьте эту команду в терминал вашего сервера.</i>",
         "node_delete_select": "🗑 <b>Удаление ноды</b>\n\nВыберите сервер, который хотите удалить:",
         "node_deleted": "✅ Нода '{name}' успешно удалена.",
@@ -392,6 +397,12 @@ STRINGS = {
         "web_copied": "Скопировано!",
         "web_resources_chart": "Ресурсы (%)",
         "web_network_chart": "Сеть (KB/s)",
+        "web_load_chart": "Нагрузка (LA)",
+        "web_disk_io_chart": "Диск I/O",
+        "web_nics_chart": "Интерфейсы",
+        "web_mounts_chart": "Разделы (%)",
+        "web_label_read": "Чтение",
+        "web_label_write": "Запись",
         "web_logs_title": "Системные Логи",
         "web_refresh": "Обновить",
         "web_loading": "Загрузка...",
@@ -949,8 +960,13 @@ STRINGS = {
         "node_restarting_alert": "🔵 Server '{name}' is restarting. Please wait 1-2 minutes.",
         "node_management_menu": "🟢 <b>Managing Server: {name}</b>\nIP: {ip}\nUptime: {uptime}\n\nSelect an action:",
         "node_cmd_sent": "Command '{cmd}' sent to server '{name}'.",
+        "node_cmd_running": "⏳ Command '{cmd}' is still running ({elapsed} s)...",
         "node_btn_add": "➕ Add Node",
         "node_btn_delete": "➖ Delete Node",
+        "nodes_view_all": "All",
+        "nodes_view_online": "🟢 Online",
+        "nodes_view_offline": "🔴 Offline",
+        "nodes_view_cpu": "🔥 CPU",
         "node_add_success_token": "✅ <b>Node Created!</b>\n\nName: <b>{name}</b>\nToken: <code>{token}</code>\n\n<b>Installation command:</b>\n<pre><code class='language-bash'>{command}</code></pre>\n\n<i>Paste this command into your server terminal.</i>",
         "node_delete_select": "🗑 <b>Delete Node</b>\n\nSelect a server you want to delete:",
         "node_deleted": "✅ Node '{name}' successfully deleted.",
@@ -1010,6 +1026,12 @@ STRINGS = {
         "web_copied": "Copied!",
         "web_resources_chart": "Resources (%)",
         "web_network_chart": "Network (KB/s)",
+        "web_load_chart": "Load average",
+        "web_disk_io_chart": "Disk I/O",
+        "web_nics_chart": "Interfaces",
+        "web_mounts_chart": "Mounts (%)",
+        "web_label_read": "Read",
+        "web_label_write": "Write",
         "web_logs_title": "System Logs",
         "web_refresh": "Refresh",
         "web_loading": "Loading...",
@@ -521,8 +521,18 @@ def get_notifications_node_settings_keyboard(token: str, node_name: str, user_id
     )
 
 
-def get_nodes_list_keyboard(nodes_dict: dict, lang: str) -> InlineKeyboardMarkup:
-    buttons = []
+def get_nodes_list_keyboard(
+    nodes_dict: dict, lang: str, view: str = "all"
+) -> InlineKeyboardMarkup:
+    buttons = [
+        [
+            InlineKeyboardButton(
+                text=("• " if key == view else "") + _(f"nodes_view_{key}", lang),
+                callback_data=f"nodes_list_view_{key}",
+            )
+            for key in ("all", "online", "offline", "cpu")
+        ]
+    ]
     for token, node_data in nodes_dict.items():
         name = node_data.get("name", "Unknown")
         icon = node_data.get("status_icon", "❓")
@@ -30,11 +30,51 @@ class Node(models.Model):
     name = EncryptedTextField()
     ip = EncryptedTextField()
     created_at = fields.FloatField(default=time.time)
-    last_seen = fields.FloatField(default=0)
+    last_seen = fields.FloatField(default=0, index=True)
     stats = fields.JSONField(default=dict)
     history = fields.JSONField(default=list)
     tasks = fields.JSONField(default=list)
     extra_state = fields.JSONField(default=dict)
+    # Copies of the latest stats values so list views can skip the JSON columns
+    cpu = fields.FloatField(default=0, index=True)
+    ram = fields.FloatField(default=0, index=True)
+    disk = fields.FloatField(default=0, index=True)
+    status = fields.CharField(max_length=16, default="offline", index=True)
 
     class Meta:
         table = "nodes"
+
+
+class NodeMetric(models.Model):
+    id = fields.IntField(pk=True)
+    node = fields.ForeignKeyField(
+        "models.Node", related_name="metrics", on_delete=fields.CASCADE
+    )
+    resolution = fields.IntField(default=0)
+    ts = fields.IntField()
+    c = fields.FloatField(default=0)
+    r = fields.FloatField(default=0)
+    rx = fields.BigIntField(default=0)
+    tx = fields.BigIntField(default=0)
+    # extra per-point metrics, e.g. {"agg": {"cpu": [min, max, mean, p95]}}
+    ext = fields.JSONField(null=True)
+
+    class Meta:
+        table = "node_metrics"
+        unique_together = (("node", "resolution", "ts"),)
+
+
+class NodeTask(models.Model):
+    id = fields.IntField(pk=True)
+    node = fields.ForeignKeyField(
+        "models.Node", related_name="queued_tasks", on_delete=fields.CASCADE
+    )
+    payload = fields.JSONField(default=dict)
+    created_at = fields.FloatField(default=time.time)
+    ttl = fields.IntField(default=300)
+    state = fields.CharField(max_length=16, default="pending")
+    delivered_at = fields.FloatField(null=True)
+
+    class Meta:
+        table = "node_tasks"
+        indexes = (("node", "state"),)
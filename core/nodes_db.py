@@ -3,25 +3,220 @@ import logging
 import secrets
 import time
 import os
+import asyncio
 import hashlib
-from tortoise import Tortoise
-from .models import Node
-from .config import CONFIG_DIR, TORTOISE_ORM
+import functools
+from collections import OrderedDict
+from tortoise import Tortoise, connections
+from tortoise.expressions import Q
+from tortoise.transactions import in_transaction
+from . import config
+from .models import Node, NodeMetric, NodeTask
+from .config import (
+    CONFIG_DIR,
+    TORTOISE_ORM,
+    NODES_DB_PATH,
+    NODES_DB_PROFILE,
+    SQLITE_PRAGMAS,
+    sqlite_connection,
+    NODES_DB_FLUSH_INTERVAL,
+    NODES_DB_MAX_PENDING,
+    NODES_DB_CACHE_SIZE,
+)
 
 LEGACY_JSON_PATH = os.path.join(CONFIG_DIR, "nodes.json")
 
+# Raw heartbeat points (resolution 0) are kept for an hour and rolled up
+# into coarser tiers: (resolution, source resolution, retention), seconds.
+HISTORY_POINTS = 60
+MAX_HISTORY_POINTS = 2016
+METRICS_RAW_RETENTION = 3600
+METRICS_TIERS = (
+    (60, 0, 86400),
+    (300, 60, 7 * 86400),
+    (3600, 300, 30 * 86400),
+)
+METRICS_RESOLUTIONS = (0,) + tuple(tier[0] for tier in METRICS_TIERS)
+METRICS_ROLLUP_GRACE = 30
+# Node-computed stats stored per point in node_metrics.ext under the same
+# keys. "agg" holds metric -> [min, max, mean, p95] over the heartbeat
+# window; rollups keep min of mins, max of maxes, mean of means and max of
+# p95s (an upper bound for the bucket's p95). load, net_rate and disk_io
+# are fixed-size lists averaged per element. Per-device nics and mounts
+# grow with the host and stay in nodes.stats (latest values only).
+METRICS_EXT_KEYS = ("agg", "load", "net_rate", "disk_io")
+METRICS_AGG_KEYS = ("cpu", "ram", "rx", "tx", "dr", "dw")
+METRICS_AVG_KEYS = {"load": 3, "net_rate": 4, "disk_io": 4}
+_ROLLUP_WATERMARKS = {}
+MAINTENANCE_INTERVAL = 60
+WAL_CHECKPOINT_INTERVAL = 300
+OPTIMIZE_INTERVAL = 3600
+VACUUM_PAGES = 1000
+_LAST_MAINTENANCE = {"checkpoint": 0, "optimize": 0}
 
+# Node commands live in node_tasks. Agents that acknowledge tasks get
+# unacknowledged ones again after NODE_TASK_ACK_TIMEOUT seconds; a task
+# nobody picked up within its TTL is dropped.
+NODE_TASK_TTL = 300
+NODE_TASK_ACK_TIMEOUT = 30
+# token_hash -> events of open push channels (node WebSockets), set
+# whenever a task is queued for that node.
+_TASK_SUBSCRIBERS = {}
+
+# Write-behind state: token_hash -> latest heartbeat of the node and the
+# history points not yet written to SQLite.
+_HEARTBEAT_BUFFER = {}
+_PENDING_HEARTBEATS = 0
+_MAX_BUFFERED_POINTS = 720
+FLUSH_MAX_FAILURES = 3
+_FLUSH_LOCK = asyncio.Lock()
+
+# LRU of decoded node rows (token_hash -> dict) for get_node_by_token.
+# Every function that changes name, tasks or extra_state must invalidate it.
+_NODE_CACHE = OrderedDict()
+_CACHE_STATS = {"hits": 0, "misses": 0, "generation": 0}
+
+# Decrypted token/name/ip per token_hash for list views. It holds one
+# small entry per node and is dropped on rename and delete.
+_IDENTITY_CACHE = {}
+
+# Token hashes of all nodes, reloaded every KNOWN_HASHES_TTL seconds and
+# kept current by create_node/delete_node. Lets the heartbeat pre-check
+# reject unknown senders without a query.
+KNOWN_HASHES_TTL = 60
+_KNOWN_HASHES = {"hashes": set(), "loaded": 0.0}
+
+# PRAGMA data_version of our connection. It changes only when another
+# process (manage.py: simulate, node commands) commits to nodes.db, which
+# the caches above cannot see; sync_external_changes() drops them then.
+_DATA_VERSION = {"value": None}
+
+# Columns added after the first release. generate_schemas() only creates
+# missing tables, so existing databases get them through ALTER TABLE.
+ADDED_COLUMNS = {
+    "nodes": {
+        "cpu": "REAL NOT NULL DEFAULT 0",
+        "ram": "REAL NOT NULL DEFAULT 0",
+        "disk": "REAL NOT NULL DEFAULT 0",
+        "status": "VARCHAR(16) NOT NULL DEFAULT 'offline'",
+    },
+    "node_metrics": {
+        "ext": "JSON",
+    },
+}
+ADDED_INDEXES = {
+    "nodes": ("cpu", "ram", "disk", "status", "last_seen"),
+}
+
+# nodes.status is "online" after a heartbeat, "restarting" while the
+# is_restarting flag is set and "offline" once last_seen is older than
+# NODE_OFFLINE_TIMEOUT (swept by the flusher, and checked again in queries).
+NODE_STATUSES = ("online", "offline", "restarting")
+NODE_SORT_FIELDS = ("cpu", "ram", "disk", "last_seen", "status")
+
+
+@functools.lru_cache(maxsize=4096)
 def _get_token_hash(token: str) -> str:
     if not token:
         return ""
     return hashlib.sha256(token.encode()).hexdigest()
 
 
-async def init_db():
-    await Tortoise.init(config=TORTOISE_ORM)
+async def init_db(db_path: str = None):
+    orm_config = TORTOISE_ORM
+    if db_path:
+        orm_config = {
+            **TORTOISE_ORM,
+            "connections": {"default": sqlite_connection(db_path)},
+        }
+    await Tortoise.init(config=orm_config)
     await Tortoise.generate_schemas()
-    logging.info(f"ORM initialized. DB: {TORTOISE_ORM['connections']['default']}")
+    await _ensure_columns()
+    logging.info(
+        f"ORM initialized. DB: {db_path or NODES_DB_PATH} (profile: {NODES_DB_PROFILE})"
+    )
+    await _enable_incremental_vacuum()
     await _migrate_from_json_if_needed()
+    await _migrate_json_columns_if_needed()
+
+
+def start_background_tasks() -> list[asyncio.Task]:
+    task_flusher = asyncio.create_task(heartbeat_flusher(), name="NodesDbFlusher")
+    task_maintenance = asyncio.create_task(
+        db_maintenance(), name="NodesDbMaintenance"
+    )
+    return [task_flusher, task_maintenance]
+
+
+async def _ensure_columns():
+    conn = connections.get("default")
+    for table, columns in ADDED_COLUMNS.items():
+        rows = await conn.execute_query_dict(f"PRAGMA table_info({table})")
+        existing = {row["name"] for row in rows}
+        added = False
+        for column, ddl in columns.items():
+            if column not in existing:
+                await conn.execute_script(
+                    f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"
+                )
+                logging.info(f"Added column {table}.{column}")
+                added = True
+        if added:
+            # generate_schemas() already created the model indexes, and on
+            # a missing column SQLite reads "cpu" as a string literal; the
+            # rebuild binds them to the new columns.
+            await conn.execute_script(f"REINDEX {table}")
+            if table == "nodes":
+                await _backfill_node_columns(conn)
+    for table, columns in ADDED_INDEXES.items():
+        indexed = set()
+        for index in await conn.execute_query_dict(f"PRAGMA index_list({table})"):
+            info = await conn.execute_query_dict(
+                f"PRAGMA index_info('{index['name']}')"
+            )
+            if len(info) == 1:
+                indexed.add(info[0]["name"])
+        for column in columns:
+            if column not in indexed:
+                await conn.execute_script(
+                    f"CREATE INDEX IF NOT EXISTS idx_{table}_{column} ON {table} ({column})"
+                )
+                logging.info(f"Added index on {table}.{column}")
+
+
+async def _backfill_node_columns(conn):
+    """Fills the status/cpu/ram/disk copies of an upgraded database from the
+    stats and last_seen already stored, so list filters and counts agree
+    with get_nodes_summary before the next heartbeat flush."""
+    await conn.execute_query(
+        "UPDATE nodes SET "
+        "cpu = COALESCE(CAST(json_extract(stats, '$.cpu') AS REAL), 0), "
+        "ram = COALESCE(CAST(json_extract(stats, '$.ram') AS REAL), 0), "
+        "disk = COALESCE(CAST(json_extract(stats, '$.disk') AS REAL), 0) "
+        "WHERE json_valid(stats)"
+    )
+    await conn.execute_query(
+        "UPDATE nodes SET status = CASE "
+        "WHEN json_valid(extra_state) "
+        "AND json_extract(extra_state, '$.is_restarting') THEN 'restarting' "
+        "WHEN last_seen > 0 THEN 'online' ELSE 'offline' END"
+    )
+    logging.info("Backfilled nodes status and resource columns")
+
+
+async def _enable_incremental_vacuum():
+    """auto_vacuum only changes on an empty database or through VACUUM, so a
+    nodes.db created before the profile existed is converted once here."""
+    if SQLITE_PRAGMAS.get("auto_vacuum") != "INCREMENTAL":
+        return
+    conn = connections.get("default")
+    try:
+        rows = await conn.execute_query_dict("PRAGMA auto_vacuum")
+        if rows and rows[0]["auto_vacuum"] != 2:
+            logging.info("Converting nodes.db to incremental auto-vacuum...")
+            await conn.execute_script("PRAGMA auto_vacuum = INCREMENTAL; VACUUM;")
+    except Exception as e:
+        logging.error(f"Could not enable incremental vacuum: {e}")
 
 
 async def _migrate_from_json_if_needed():
@@ -57,43 +252,227 @@ async def _migrate_from_json_if_needed():
         logging.error(f"❌ CRITICAL: Migration failed: {e}", exc_info=True)
 
 
+async def _migrate_json_columns_if_needed():
+    """Moves the legacy Node.history and Node.tasks JSON lists into the
+    node_metrics and node_tasks tables."""
+    try:
+        rows = await Node.all().values_list("id", "history", "tasks")
+        moved = 0
+        for node_id, history, tasks in rows:
+            if not history and not tasks:
+                continue
+            points = [_make_metric(node_id, p.get("t", 0), p) for p in history or [] if p]
+            await NodeMetric.bulk_create(points, ignore_conflicts=True)
+            await NodeTask.bulk_create(
+                [NodeTask(node_id=node_id, payload=task) for task in tasks or []]
+            )
+            await Node.filter(id=node_id).update(history=[], tasks=[])
+            moved += 1
+        if moved:
+            logging.info(f"Moved legacy history/tasks of {moved} nodes to tables.")
+    except Exception as e:
+        logging.error(f"History/tasks migration failed: {e}", exc_info=True)
+
+
+def _make_metric(node_id: int, ts: int, point: dict, resolution: int = 0):
+    return NodeMetric(
+        node_id=node_id,
+        resolution=resolution,
+        ts=int(ts),
+        c=point.get("c", 0) or 0,
+        r=point.get("r", 0) or 0,
+        rx=int(point.get("rx", 0) or 0),
+        tx=int(point.get("tx", 0) or 0),
+        ext=point.get("ext"),
+    )
+
+
 async def get_all_nodes():
     nodes = await Node.all()
     result = {}
     for node in nodes:
         real_token = node.token_safe or "ErrorDecryption"
-        result[real_token] = {
+        result[real_token] = _apply_buffered({
             "token": real_token,
             "name": node.name,
             "created_at": node.created_at,
             "last_seen": node.last_seen,
             "ip": node.ip,
             "stats": node.stats,
-            "tasks": node.tasks,
-            "history": node.history,
             **node.extra_state,
+        }, node.token_hash)
+    return result
+
+
+def _apply_buffered(data: dict, t_hash: str) -> dict:
+    record = _HEARTBEAT_BUFFER.get(t_hash)
+    if record and "last_seen" in record:
+        data.update(
+            last_seen=record["last_seen"], ip=record["ip"], stats=record["stats"]
+        )
+    return data
+
+
+def _node_status(last_seen: float, is_restarting: bool, now: float) -> str:
+    if is_restarting:
+        return "restarting"
+    if now - last_seen < config.NODE_OFFLINE_TIMEOUT:
+        return "online"
+    return "offline"
+
+
+def _status_filter(status: str, now: float) -> Q:
+    cutoff = now - config.NODE_OFFLINE_TIMEOUT
+    if status == "online":
+        return Q(status="online", last_seen__gte=cutoff)
+    if status == "offline":
+        return Q(status="offline") | Q(status="online", last_seen__lt=cutoff)
+    if status == "restarting":
+        return Q(status="restarting")
+    raise ValueError(f"Unknown node status: {status}")
+
+
+async def get_nodes_summary(
+    status: str = None, sort: str = None, limit: int = None
+) -> dict:
+    """Lightweight variant of get_all_nodes() for list views.
+
+    Returns token, name, ip, last_seen, status, cpu/ram/disk and the
+    extra_state flags only. stats, history and tasks are never loaded, and
+    the encrypted columns are decrypted once per node, not on every call.
+    status, sort ("cpu", "-cpu", ...) and limit are applied in SQL; bad
+    values raise ValueError.
+    """
+    now = time.time()
+    query = Node.all()
+    if status:
+        query = query.filter(_status_filter(status, now))
+    if sort:
+        if sort.lstrip("-") not in NODE_SORT_FIELDS:
+            raise ValueError(f"Unknown sort field: {sort}")
+        query = query.order_by(sort, "id")
+    else:
+        query = query.order_by("id")
+    if limit is not None:
+        if limit <= 0:
+            raise ValueError("limit must be positive")
+        query = query.limit(limit)
+    rows = await query.values(
+        "id", "token_hash", "last_seen", "cpu", "ram", "disk", "extra_state"
+    )
+    missing = [row["id"] for row in rows if row["token_hash"] not in _IDENTITY_CACHE]
+    if missing:
+        for ident in await Node.filter(id__in=missing).values(
+            "token_hash", "token_safe", "name", "ip"
+        ):
+            _IDENTITY_CACHE[ident["token_hash"]] = {
+                "token": ident["token_safe"] or "ErrorDecryption",
+                "name": ident["name"],
+                "ip": ident["ip"],
+            }
+    result = {}
+    for row in rows:
+        t_hash = row["token_hash"]
+        identity = _IDENTITY_CACHE.get(t_hash)
+        if not identity:
+            continue
+        summary = {
+            **identity,
+            "last_seen": row["last_seen"],
+            "cpu": row["cpu"],
+            "ram": row["ram"],
+            "disk": row["disk"],
+            **(row["extra_state"] or {}),
         }
+        record = _HEARTBEAT_BUFFER.get(t_hash)
+        if record and "last_seen" in record:
+            stats = record["stats"]
+            summary.update(
+                last_seen=record["last_seen"],
+                ip=record["ip"],
+                cpu=stats.get("cpu", 0),
+                ram=stats.get("ram", 0),
+                disk=stats.get("disk", 0),
+            )
+        summary["status"] = _node_status(
+            summary["last_seen"], summary.get("is_restarting", False), now
+        )
+        result[identity["token"]] = summary
     return result
 
 
+async def count_nodes_by_status() -> dict:
+    """Node counts per status, computed in a single aggregate query."""
+    conn = connections.get("default")
+    rows = await conn.execute_query_dict(
+        "SELECT CASE WHEN status = 'restarting' THEN 'restarting' "
+        "WHEN status = 'online' AND last_seen >= ? THEN 'online' "
+        "ELSE 'offline' END AS state, COUNT(*) AS total "
+        "FROM nodes GROUP BY state",
+        [time.time() - config.NODE_OFFLINE_TIMEOUT],
+    )
+    counts = dict.fromkeys(NODE_STATUSES, 0)
+    for row in rows:
+        counts[row["state"]] = row["total"]
+    counts["total"] = sum(counts.values())
+    return counts
+
+
 async def get_node_by_token(token: str):
     t_hash = _get_token_hash(token)
+    cached = _NODE_CACHE.get(t_hash)
+    if cached is not None:
+        _NODE_CACHE.move_to_end(t_hash)
+        _CACHE_STATS["hits"] += 1
+        return _apply_buffered(dict(cached), t_hash)
+    _CACHE_STATS["misses"] += 1
+    generation = _CACHE_STATS["generation"]
     node = await Node.get_or_none(token_hash=t_hash)
     if node:
         base = {
+            "id": node.id,
             "token": node.token_safe,
             "name": node.name,
             "created_at": node.created_at,
             "last_seen": node.last_seen,
             "ip": node.ip,
             "stats": node.stats,
-            "tasks": node.tasks,
-            "history": node.history,
         }
-        return {**base, **node.extra_state}
+        record = {**base, **node.extra_state}
+        # Skip caching if the node was changed while we were reading it.
+        if generation == _CACHE_STATS["generation"]:
+            _NODE_CACHE[t_hash] = record
+            if len(_NODE_CACHE) > NODES_DB_CACHE_SIZE:
+                _NODE_CACHE.popitem(last=False)
+        return _apply_buffered(dict(record), t_hash)
     return None
 
 
+def _invalidate_cached(t_hash: str):
+    _NODE_CACHE.pop(t_hash, None)
+    _CACHE_STATS["generation"] += 1
+
+
+async def get_known_token_hashes() -> set:
+    if time.time() - _KNOWN_HASHES["loaded"] > KNOWN_HASHES_TTL:
+        _KNOWN_HASHES["hashes"] = set(
+            await Node.all().values_list("token_hash", flat=True)
+        )
+        _KNOWN_HASHES["loaded"] = time.time()
+    return _KNOWN_HASHES["hashes"]
+
+
+def get_cache_stats() -> dict:
+    lookups = _CACHE_STATS["hits"] + _CACHE_STATS["misses"]
+    return {
+        "size": len(_NODE_CACHE),
+        "capacity": NODES_DB_CACHE_SIZE,
+        "hits": _CACHE_STATS["hits"],
+        "misses": _CACHE_STATS["misses"],
+        "hit_ratio": round(_CACHE_STATS["hits"] / lookups, 4) if lookups else 0.0,
+    }
+
+
 async def create_node(name: str) -> str:
     raw_token = secrets.token_hex(16)
     await Node.create(
@@ -102,16 +481,17 @@ async def create_node(name: str) -> str:
         name=name,
         ip="Unknown",
     )
+    _KNOWN_HASHES["hashes"].add(_get_token_hash(raw_token))
     logging.info(f"Created new encrypted node: {name}")
     return raw_token
 
 
 async def update_node_name(token: str, new_name: str):
     t_hash = _get_token_hash(token)
-    node = await Node.get_or_none(token_hash=t_hash)
-    if node:
-        node.name = new_name
-        await node.save()
+    updated = await Node.filter(token_hash=t_hash).update(name=new_name)
+    if updated:
+        _invalidate_cached(t_hash)
+        _IDENTITY_CACHE.pop(t_hash, None)
         logging.info(f"Node renamed to: {new_name}")
         return True
     return False
@@ -119,56 +499,524 @@ async def update_node_name(token: str, new_name: str):
 
 async def delete_node(token: str):
     t_hash = _get_token_hash(token)
+    _HEARTBEAT_BUFFER.pop(t_hash, None)
     await Node.filter(token_hash=t_hash).delete()
+    _invalidate_cached(t_hash)
+    _IDENTITY_CACHE.pop(t_hash, None)
+    _KNOWN_HASHES["hashes"].discard(t_hash)
     logging.info(f"Node deleted.")
 
 
 async def update_node_heartbeat(token: str, ip: str, stats: dict):
     t_hash = _get_token_hash(token)
-    node = await Node.get_or_none(token_hash=t_hash)
-    if not node:
-        return
-    history = node.history or []
+    record = _HEARTBEAT_BUFFER.get(t_hash)
+    if record is None:
+        node_ids = await Node.filter(token_hash=t_hash).values_list("id", flat=True)
+        if not node_ids:
+            return
+        record = _buffer_record(t_hash, node_ids[0])
+    await _buffer_heartbeat(record, ip, stats)
+
+
+def _buffer_record(t_hash: str, node_id: int) -> dict:
+    return _HEARTBEAT_BUFFER.setdefault(
+        t_hash, {"id": node_id, "points": [], "dirty": False}
+    )
+
+
+def _metric_point(stats: dict) -> dict:
     point = {
-        "t": int(time.time()),
         "c": stats.get("cpu", 0),
         "r": stats.get("ram", 0),
         "rx": stats.get("net_rx", 0),
         "tx": stats.get("net_tx", 0),
     }
-    history.append(point)
-    if len(history) > 60:
-        history = history[-60:]
-    node.last_seen = time.time()
-    node.ip = ip
-    node.stats = stats
-    node.history = history
-    await node.save()
+    ext = {key: stats[key] for key in METRICS_EXT_KEYS if stats.get(key)}
+    if ext:
+        point["ext"] = ext
+    return point
 
 
-async def update_node_task(token: str, task: dict):
+def _history_point(ts: int, c, r, rx, tx, ext) -> dict:
+    point = {"t": ts, "c": c, "r": r, "rx": rx, "tx": tx}
+    if ext:
+        point.update((key, value) for key, value in ext.items() if value is not None)
+    return point
+
+
+async def _buffer_heartbeat(record: dict, ip: str, stats: dict):
+    global _PENDING_HEARTBEATS
+    now = time.time()
+    record.update(last_seen=now, ip=ip, stats=stats, dirty=True)
+    # a node that failed to sample sends {}; that is no zero reading
+    if stats:
+        point = _make_metric(record["id"], now, _metric_point(stats))
+        points = record["points"]
+        # points are keyed by whole seconds; the latest sample wins
+        if points and points[-1].ts == point.ts:
+            points[-1] = point
+        else:
+            points.append(point)
+    _PENDING_HEARTBEATS += 1
+    if _PENDING_HEARTBEATS >= NODES_DB_MAX_PENDING:
+        await flush_heartbeats()
+
+
+def merge_stats_delta(token: str, seq: int, delta: dict):
+    """Applies a delta heartbeat to the node's buffered stats.
+
+    Returns the merged stats, or None when there is nothing to merge into
+    or seq does not follow the last one seen; the node must then resend a
+    full snapshot.
+    """
+    record = _HEARTBEAT_BUFFER.get(_get_token_hash(token))
+    if not record or "stats" not in record or record.get("seq") is None:
+        return None
+    if not isinstance(seq, int) or seq != record["seq"] + 1:
+        return None
+    return {**record["stats"], **delta}
+
+
+async def ingest_heartbeat(
+    token: str, ip: str, stats: dict, acks: list = None, seq: int = None
+):
+    """Storage side of a node heartbeat in one call.
+
+    Loads the node once (usually from the LRU), buffers stats and history,
+    clears the restarting flag and hands out pending tasks. The flag and
+    the task statements share one transaction. stats=None (a delta that
+    needs a resync, or a heartbeat without stats) only hands out tasks. Returns (node, tasks), or
+    (None, []) for an unknown token.
+    """
+    node = await get_node_by_token(token)
+    if node is None:
+        return None, []
     t_hash = _get_token_hash(token)
-    node = await Node.get_or_none(token_hash=t_hash)
-    if node:
-        tasks = node.tasks or []
-        tasks.append(task)
-        node.tasks = tasks
-        await node.save()
+    node_id = node["id"]
+    ack_ids = [int(a) for a in acks if str(a).isdigit()] if acks else []
+    if node.get("is_restarting") or ack_ids:
+        async with in_transaction():
+            if node.get("is_restarting"):
+                await _clear_restarting(node_id)
+            tasks = await _take_tasks(node_id, acks is not None, ack_ids)
+        if node.get("is_restarting"):
+            _invalidate_cached(t_hash)
+            node["is_restarting"] = False
+    else:
+        tasks = await _take_tasks(node_id, acks is not None, ack_ids)
+    if stats is not None:
+        # the node may have been deleted while the task queries awaited
+        if t_hash not in _HEARTBEAT_BUFFER and not await Node.exists(id=node_id):
+            return None, []
+        record = _buffer_record(t_hash, node_id)
+        record["seq"] = seq
+        await _buffer_heartbeat(record, ip, stats)
+    return node, tasks
+
+
+async def _clear_restarting(node_id: int):
+    conn = connections.get("default")
+    await conn.execute_query(
+        "UPDATE nodes SET extra_state = json_set(extra_state, '$.is_restarting', "
+        "json('false')), status = 'online' WHERE id = ?",
+        [node_id],
+    )
+
+
+async def flush_heartbeats() -> int:
+    """Writes all buffered heartbeats to SQLite in a single transaction.
+
+    If the batch fails, every record is retried on its own so one bad
+    record cannot hold back the fleet; a record that fails
+    FLUSH_MAX_FAILURES times in a row is dropped from the buffer. Records
+    of deleted nodes (UPDATE matched no row) are dropped as well.
+    """
+    global _PENDING_HEARTBEATS
+    async with _FLUSH_LOCK:
+        batch = []
+        for t_hash, record in _HEARTBEAT_BUFFER.items():
+            if not record["dirty"]:
+                continue
+            batch.append((t_hash, record, record["points"]))
+            record["points"] = []
+            record["dirty"] = False
+        _PENDING_HEARTBEATS = 0
+        if not batch:
+            return 0
+        try:
+            async with in_transaction():
+                gone = await _write_heartbeats(batch)
+        except Exception as e:
+            logging.error(f"Heartbeat batch flush failed, writing nodes one by one: {e}")
+            gone = set()
+            failed = set()
+            for item in batch:
+                try:
+                    async with in_transaction():
+                        gone |= await _write_heartbeats([item])
+                except Exception as e:
+                    failed.add(item[0])
+                    _requeue_failed(item, e)
+            batch = [item for item in batch if item[0] not in failed]
+        for t_hash in gone:
+            _HEARTBEAT_BUFFER.pop(t_hash, None)
+        written = 0
+        for t_hash, record, _ in batch:
+            if t_hash in gone:
+                continue
+            record["saved_ip"] = record["ip"]
+            record["failures"] = 0
+            identity = _IDENTITY_CACHE.get(t_hash)
+            if identity:
+                identity["ip"] = record["ip"]
+            written += 1
+        return written
+
+
+async def _write_heartbeats(batch: list) -> set:
+    """Statements of one flush; returns the token hashes of nodes that no
+    longer exist, whose points are skipped."""
+    gone = set()
+    for t_hash, record, _ in batch:
+        stats = record["stats"]
+        values = {
+            "last_seen": record["last_seen"],
+            "stats": stats,
+            "cpu": stats.get("cpu", 0) or 0,
+            "ram": stats.get("ram", 0) or 0,
+            "disk": stats.get("disk", 0) or 0,
+        }
+        if record["ip"] != record.get("saved_ip"):
+            values["ip"] = record["ip"]
+        if not await Node.filter(token_hash=t_hash).update(**values):
+            gone.add(t_hash)
+    present = [item for item in batch if item[0] not in gone]
+    if present:
+        await Node.filter(
+            token_hash__in=[t_hash for t_hash, _, _ in present]
+        ).exclude(status="restarting").update(status="online")
+        # a point for a second already flushed replaces the stored one
+        await NodeMetric.bulk_create(
+            [p for _, _, points in present for p in points],
+            on_conflict=["node_id", "resolution", "ts"],
+            update_fields=["c", "r", "rx", "tx", "ext"],
+        )
+    return gone
+
+
+def _requeue_failed(item: tuple, error: Exception):
+    t_hash, record, points = item
+    record["failures"] = record.get("failures", 0) + 1
+    if record["failures"] >= FLUSH_MAX_FAILURES:
+        # the node resends a full snapshot once its record is gone
+        if _HEARTBEAT_BUFFER.get(t_hash) is record:
+            del _HEARTBEAT_BUFFER[t_hash]
+        logging.error(
+            f"Dropping buffered heartbeat of node {record['id']} after "
+            f"{record['failures']} failed flushes: {error}"
+        )
+        return
+    logging.warning(f"Heartbeat flush of node {record['id']} failed, will retry: {error}")
+    record["points"] = (points + record["points"])[-_MAX_BUFFERED_POINTS:]
+    record["dirty"] = True
+
+
+async def heartbeat_flusher():
+    while True:
+        await asyncio.sleep(NODES_DB_FLUSH_INTERVAL)
+        try:
+            await sync_external_changes()
+            await flush_heartbeats()
+            await mark_offline_nodes()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Error in heartbeat flusher: {e}", exc_info=True)
 
 
-async def clear_node_tasks(token: str):
+async def sync_external_changes() -> bool:
+    """Drops the node caches if another process committed to nodes.db
+    since the last call, so nodes it created or deleted and tasks it
+    queued are seen without a restart. Returns True if it did."""
+    conn = connections.get("default")
+    rows = await conn.execute_query_dict("PRAGMA data_version")
+    version = rows[0]["data_version"]
+    previous, _DATA_VERSION["value"] = _DATA_VERSION["value"], version
+    if previous is None or previous == version:
+        return False
+    _NODE_CACHE.clear()
+    _CACHE_STATS["generation"] += 1
+    _IDENTITY_CACHE.clear()
+    _KNOWN_HASHES["loaded"] = 0.0
+    buffered = {record["id"]: t_hash for t_hash, record in _HEARTBEAT_BUFFER.items()}
+    if buffered:
+        alive = set(await Node.filter(id__in=list(buffered)).values_list("id", flat=True))
+        for node_id, t_hash in buffered.items():
+            if node_id not in alive:
+                _HEARTBEAT_BUFFER.pop(t_hash, None)
+    for events in _TASK_SUBSCRIBERS.values():
+        for event in events:
+            event.set()
+    return True
+
+
+async def mark_offline_nodes(now: float = None) -> int:
+    cutoff = (now or time.time()) - config.NODE_OFFLINE_TIMEOUT
+    return await Node.filter(status="online", last_seen__lt=cutoff).update(
+        status="offline"
+    )
+
+
+async def get_node_history(
+    token: str, resolution: int = 0, limit: int = HISTORY_POINTS
+) -> list:
+    if resolution not in METRICS_RESOLUTIONS:
+        resolution = 0
+    limit = max(1, min(int(limit), MAX_HISTORY_POINTS))
     t_hash = _get_token_hash(token)
-    node = await Node.get_or_none(token_hash=t_hash)
-    if node:
-        node.tasks = []
-        await node.save()
+    record = _HEARTBEAT_BUFFER.get(t_hash)
+    if record:
+        node_id = record["id"]
+    else:
+        node_ids = await Node.filter(token_hash=t_hash).values_list("id", flat=True)
+        if not node_ids:
+            return []
+        node_id = node_ids[0]
+    rows = (
+        await NodeMetric.filter(node_id=node_id, resolution=resolution)
+        .order_by("-ts")
+        .limit(limit)
+        .values("ts", "c", "r", "rx", "tx", "ext")
+    )
+    history = [
+        _history_point(row["ts"], row["c"], row["r"], row["rx"], row["tx"], row["ext"])
+        for row in reversed(rows)
+    ]
+    if record and resolution == 0:
+        history.extend(
+            _history_point(m.ts, m.c, m.r, m.rx, m.tx, m.ext)
+            for m in record["points"]
+        )
+    return history[-limit:]
 
 
+async def ingest_backfill(token: str, samples: list, now: float = None):
+    """Stores [timestamp, stats] samples a node spooled while the agent was
+    unreachable. Only node_metrics is written: last_seen, stats and alert
+    state stay untouched, so stale points never trigger alerts. Returns
+    the number of points kept, or None for an unknown token."""
+    node_id = await _get_node_id(_get_token_hash(token))
+    if node_id is None:
+        return None
+    now = now or time.time()
+    oldest_allowed = now - METRICS_TIERS[-1][2]
+    points = []
+    for sample in samples:
+        if not isinstance(sample, (list, tuple)) or len(sample) != 2:
+            continue
+        ts, stats = sample
+        if isinstance(ts, (int, float)) and isinstance(stats, dict) and oldest_allowed < ts <= now:
+            points.append(_make_metric(node_id, ts, _metric_point(stats)))
+    if not points:
+        return 0
+    await NodeMetric.bulk_create(points, ignore_conflicts=True)
+    # rollups already past these points must revisit their buckets
+    oldest = min(point.ts for point in points)
+    for resolution, watermark in _ROLLUP_WATERMARKS.items():
+        _ROLLUP_WATERMARKS[resolution] = min(watermark, oldest // resolution * resolution)
+    return len(points)
+
+
+def _ext_rollup_sql() -> str:
+    agg = []
+    for key in METRICS_AGG_KEYS:
+        path = f"json_extract(ext, '$.agg.{key}"
+        agg.append(
+            f"'{key}', json_array(MIN({path}[0]')), MAX({path}[1]')), "
+            f"AVG({path}[2]')), MAX({path}[3]')))"
+        )
+    parts = [
+        "'agg', json(CASE WHEN COUNT(json_extract(ext, '$.agg')) > 0 "
+        f"THEN json_object({', '.join(agg)}) END)"
+    ]
+    for key, size in METRICS_AVG_KEYS.items():
+        items = ", ".join(
+            f"AVG(json_extract(ext, '$.{key}[{i}]'))" for i in range(size)
+        )
+        parts.append(
+            f"'{key}', json(CASE WHEN COUNT(json_extract(ext, '$.{key}')) > 0 "
+            f"THEN json_array({items}) END)"
+        )
+    return f"CASE WHEN COUNT(ext) > 0 THEN json_object({', '.join(parts)}) END"
+
+
+async def rollup_metrics(now: float = None):
+    """Aggregates closed buckets of each tier from its source tier and
+    drops points that are past their tier's retention."""
+    now = now or time.time()
+    conn = connections.get("default")
+    retention = {0: METRICS_RAW_RETENTION}
+    grace = max(METRICS_ROLLUP_GRACE, 2 * NODES_DB_FLUSH_INTERVAL)
+    for resolution, source, keep in METRICS_TIERS:
+        retention[resolution] = keep
+        cutoff = int(now - grace) // resolution * resolution
+        since = _ROLLUP_WATERMARKS.get(
+            resolution, (cutoff - retention[source]) // resolution * resolution
+        )
+        if cutoff > since:
+            # Buckets revisited after a backfill are recomputed, but only
+            # while their source points are all still retained; an older
+            # bucket would otherwise be rebuilt from the backfill alone.
+            complete_since = int(now - retention[source]) // resolution * resolution + resolution
+            await conn.execute_query(
+                "INSERT INTO node_metrics "
+                "(node_id, resolution, ts, c, r, rx, tx, ext) "
+                "SELECT node_id, ?, (ts / ?) * ?, AVG(c), AVG(r), MAX(rx), MAX(tx), "
+                f"{_ext_rollup_sql()} "
+                "FROM node_metrics WHERE resolution = ? AND ts >= ? AND ts < ? "
+                "GROUP BY node_id, ts / ? "
+                "ON CONFLICT(node_id, resolution, ts) DO UPDATE SET "
+                "c = excluded.c, r = excluded.r, rx = excluded.rx, tx = excluded.tx, "
+                "ext = excluded.ext WHERE node_metrics.ts >= ?",
+                [resolution, resolution, resolution, source, since, cutoff, resolution,
+                 complete_since],
+            )
+            _ROLLUP_WATERMARKS[resolution] = cutoff
+    for resolution, keep in retention.items():
+        await NodeMetric.filter(resolution=resolution, ts__lt=int(now - keep)).delete()
+
+
+async def db_maintenance():
+    while True:
+        await asyncio.sleep(MAINTENANCE_INTERVAL)
+        try:
+            await rollup_metrics()
+            await purge_expired_tasks()
+            await optimize_db()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Error in nodes DB maintenance: {e}", exc_info=True)
+
+
+async def optimize_db(now: float = None):
+    """Keeps the WAL short and the planner statistics fresh, and hands
+    pages freed by retention back to the filesystem."""
+    now = now or time.time()
+    conn = connections.get("default")
+    if now - _LAST_MAINTENANCE["checkpoint"] >= WAL_CHECKPOINT_INTERVAL:
+        await conn.execute_query("PRAGMA wal_checkpoint(TRUNCATE)")
+        _LAST_MAINTENANCE["checkpoint"] = now
+    if now - _LAST_MAINTENANCE["optimize"] >= OPTIMIZE_INTERVAL:
+        await conn.execute_query("ANALYZE")
+        await conn.execute_query(f"PRAGMA incremental_vacuum({VACUUM_PAGES})")
+        _LAST_MAINTENANCE["optimize"] = now
+
+
+async def _get_node_id(t_hash: str):
+    record = _HEARTBEAT_BUFFER.get(t_hash)
+    if record:
+        return record["id"]
+    node_ids = await Node.filter(token_hash=t_hash).values_list("id", flat=True)
+    return node_ids[0] if node_ids else None
+
+
+async def update_node_task(token: str, task: dict, ttl: int = NODE_TASK_TTL):
+    t_hash = _get_token_hash(token)
+    node_id = await _get_node_id(t_hash)
+    if node_id is not None:
+        await NodeTask.create(node_id=node_id, payload=task, ttl=ttl)
+        for event in _TASK_SUBSCRIBERS.get(t_hash, ()):
+            event.set()
+
+
+def subscribe_tasks(token: str) -> asyncio.Event:
+    event = asyncio.Event()
+    _TASK_SUBSCRIBERS.setdefault(_get_token_hash(token), []).append(event)
+    return event
+
+
+def unsubscribe_tasks(token: str, event: asyncio.Event):
+    t_hash = _get_token_hash(token)
+    events = _TASK_SUBSCRIBERS.get(t_hash, [])
+    if event in events:
+        events.remove(event)
+    if not events:
+        _TASK_SUBSCRIBERS.pop(t_hash, None)
+
+
+async def take_node_tasks(token: str, acks: list = None) -> list:
+    """Hands out the node's pending tasks.
+
+    acks is the list of task ids the node reports as executed. Agents that
+    send it (even empty) get at-least-once delivery; for older agents that
+    do not, tasks are deleted as they are handed out.
+    """
+    node_id = await _get_node_id(_get_token_hash(token))
+    if node_id is None:
+        return []
+    ack_ids = [int(a) for a in acks if str(a).isdigit()] if acks else []
+    return await _take_tasks(node_id, acks is not None, ack_ids)
+
+
+async def _take_tasks(node_id: int, acking: bool, ack_ids: list) -> list:
+    # SELECT, then UPDATE/DELETE by id in one transaction: RETURNING needs
+    # SQLite 3.35, newer than the system Python of some supported distros.
+    now = time.time()
+    async with in_transaction() as conn:
+        if not acking:
+            rows = await conn.execute_query_dict(
+                "SELECT id, payload FROM node_tasks WHERE node_id = ? "
+                "AND state = 'pending' AND created_at + ttl > ?",
+                [node_id, now],
+            )
+            if rows:
+                await NodeTask.filter(id__in=[row["id"] for row in rows]).using_db(
+                    conn
+                ).delete()
+        else:
+            if ack_ids:
+                await NodeTask.filter(node_id=node_id, id__in=ack_ids).using_db(
+                    conn
+                ).delete()
+            rows = await conn.execute_query_dict(
+                "SELECT id, payload FROM node_tasks WHERE node_id = ? "
+                "AND created_at + ttl > ? AND (state = 'pending' "
+                "OR (state = 'delivered' AND delivered_at < ?))",
+                [node_id, now, now - NODE_TASK_ACK_TIMEOUT],
+            )
+            if rows:
+                await NodeTask.filter(id__in=[row["id"] for row in rows]).using_db(
+                    conn
+                ).update(state="delivered", delivered_at=now)
+    tasks = []
+    for row in sorted(rows, key=lambda r: r["id"]):
+        payload = row["payload"]
+        if isinstance(payload, str):
+            payload = json.loads(payload)
+        tasks.append({**payload, "id": row["id"]})
+    return tasks
+
+
+async def purge_expired_tasks(now: float = None):
+    now = now or time.time()
+    conn = connections.get("default")
+    await conn.execute_query(
+        "DELETE FROM node_tasks WHERE created_at + ttl < ?", [now]
+    )
+
+
+# Reads and writes only the extra_state column. A full node.save() would
+# also re-encrypt token_safe, name and ip, and Fernet's random IV turns
+# that into fresh ciphertext on every call.
 async def update_node_extra(token: str, key: str, value):
     t_hash = _get_token_hash(token)
-    node = await Node.get_or_none(token_hash=t_hash)
-    if node:
-        extra = node.extra_state or {}
+    rows = await Node.filter(token_hash=t_hash).values_list("extra_state", flat=True)
+    if rows:
+        extra = rows[0] or {}
         extra[key] = value
-        node.extra_state = extra
-        await node.save()
+        values = {"extra_state": extra}
+        if key == "is_restarting":
+            values["status"] = "restarting" if value else "online"
+        await Node.filter(token_hash=t_hash).update(**values)
+        _invalidate_cached(t_hash)
@@ -5,6 +5,7 @@ import json
 import secrets
 import asyncio
 import hashlib
+import random
 import ipaddress
 from argon2 import PasswordHasher, exceptions as argon2_exceptions
 import hmac
@@ -13,13 +14,26 @@ from aiogram import Bot
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from collections import deque
 from jinja2 import Environment, FileSystemLoader, select_autoescape
+import ip_resolver
 from . import nodes_db
+from . import heartbeat_guard
+
+try:
+    import msgpack
+
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
 from .config import (
     WEB_SERVER_HOST,
     WEB_SERVER_PORT,
-    NODE_OFFLINE_TIMEOUT,
     BASE_DIR,
     ADMIN_USER_ID,
+    HEARTBEAT_WATCHED_INTERVAL_MS,
+    HEARTBEAT_ALERT_INTERVAL_MS,
+    HEARTBEAT_IDLE_INTERVAL_MS,
+    HEARTBEAT_TARGET_RATE,
+    HEARTBEAT_JITTER,
     ENABLE_WEB_UI,
     save_system_config,
     BOT_LOG_DIR,
@@ -77,6 +91,35 @@ TEMPLATE_DIR = os.path.join(BASE_DIR, "core", "templates")
 STATIC_DIR = os.path.join(BASE_DIR, "core", "static")
 AGENT_FLAG = "🏳️"
 AGENT_IP_CACHE = "Loading..."
+IP_RESOLVER = ip_resolver.ExternalIPResolver(
+    heuristics=ip_resolver.parse_heuristics(current_config.EXTERNAL_IP_HEURISTICS),
+    static_ip=current_config.EXTERNAL_IP,
+    ttl=current_config.EXTERNAL_IP_TTL,
+)
+# Heartbeat protocol advertised to nodes; 2 adds seq-numbered stats deltas,
+# 3 lets a heartbeat carry only results/acks/logins (no stats or delta).
+HEARTBEAT_PROTO = 3
+# Body formats and Content-Encodings /api/heartbeat accepts, most compact
+# first. aiohttp inflates gzip/deflate bodies before the handler reads
+# them, so the HMAC always covers the uncompressed body.
+HEARTBEAT_FORMATS = (["msgpack"] if MSGPACK_AVAILABLE else []) + ["json"]
+HEARTBEAT_ENCODINGS = ["gzip", "deflate"]
+# Optional WebSocket channel for nodes (/api/node/ws). The hello frame
+# must be signed within NODE_WS_HELLO_MAX_AGE seconds of its timestamp.
+NODE_WS_ENABLED = os.environ.get("NODE_WS_ENABLED", "true").lower() == "true"
+NODE_WS_HELLO_MAX_AGE = 300
+# SSH logins reported by nodes are alerted from a bounded queue by a few
+# workers, so slow flag lookups and Telegram fan-out never delay heartbeats.
+SSH_ALERT_QUEUE_SIZE = 1000
+SSH_ALERT_WORKERS = 4
+SSH_ALERT_QUEUE = asyncio.Queue(maxsize=SSH_ALERT_QUEUE_SIZE)
+SSH_ALERT_TASKS = []
+SSH_ALERT_STATS = {"sent": 0, "dropped": 0}
+# token -> number of open node-details streams; watched nodes report faster.
+WATCHED_NODES = {}
+# Heartbeats per second over the last HEARTBEAT_RATE_WINDOW seconds.
+HEARTBEAT_RATE_WINDOW = 10
+HEARTBEAT_RATE = {"started": time.time(), "count": 0, "rate": 0.0}
 RESET_TOKENS = {}
 SERVER_SESSIONS = {}
 CSRF_TOKENS = {}  # Store CSRF tokens with expiry
@@ -633,15 +676,9 @@ async def handle_dashboard(request):
     meta_locked = web_meta.get("locked", False)
     custom_title = web_meta.get("title", "")
     page_title = custom_title if custom_title else f"{_('web_dashboard_title', lang)} - {TG_BOT_NAME}"
-    all_nodes = await nodes_db.get_all_nodes()
-    nodes_count = len(all_nodes)
-    active_nodes = sum(
-        (
-            1
-            for n in all_nodes.values()
-            if time.time() - n.get("last_seen", 0) < NODE_OFFLINE_TIMEOUT
-        )
-    )
+    node_counts = await nodes_db.count_nodes_by_status()
+    nodes_count = node_counts["total"]
+    active_nodes = node_counts["online"]
     role = user.get("role", "users")
     is_main_admin = user_id == ADMIN_USER_ID
     is_admin = role == "admins" or is_main_admin
@@ -680,6 +717,7 @@ async def handle_dashboard(request):
             if uid != ADMIN_USER_ID
         ]
         users_json = json.dumps(ulist)
+        all_nodes = await nodes_db.get_nodes_summary()
         nlist = [
             {
                 "token": encrypt_for_web(t),
@@ -758,6 +796,10 @@ async def handle_dashboard(request):
         "web_copied": _("web_copied", lang),
         "web_resources_chart": _("web_resources_chart", lang),
         "web_network_chart": _("web_network_chart", lang),
+        "web_load_chart": _("web_load_chart", lang),
+        "web_disk_io_chart": _("web_disk_io_chart", lang),
+        "web_nics_chart": _("web_nics_chart", lang),
+        "web_mounts_chart": _("web_mounts_chart", lang),
         "web_token_label": _("web_token_label", lang),
         "web_stats_total": _("web_stats_total", lang),
         "web_stats_active": _("web_stats_active", lang),
@@ -811,6 +853,8 @@ async def handle_dashboard(request):
                 "web_label_cpu": _("web_label_cpu", lang),
                 "web_label_ram": _("web_label_ram", lang),
                 "web_label_disk": _("web_label_disk", lang),
+                "web_label_read": _("web_label_read", lang),
+                "web_label_write": _("web_label_write", lang),
                 "web_label_status": _("web_label_status", lang),
                 "modal_title_info": _("web_node_details_title", lang),
                 "web_click_copy": _("web_click_copy", lang),
@@ -864,72 +908,163 @@ async def handle_dashboard(request):
     return web.Response(text=html, content_type="text/html")
 
 
-async def handle_heartbeat(request):
+def _track_heartbeat_rate() -> float:
+    now = time.time()
+    HEARTBEAT_RATE["count"] += 1
+    elapsed = now - HEARTBEAT_RATE["started"]
+    if elapsed >= HEARTBEAT_RATE_WINDOW:
+        HEARTBEAT_RATE["rate"] = HEARTBEAT_RATE["count"] / elapsed
+        HEARTBEAT_RATE["started"] = now
+        HEARTBEAT_RATE["count"] = 0
+    return HEARTBEAT_RATE["rate"]
+
+
+def _has_active_alert(node: dict) -> bool:
+    return any(state.get("active") for state in node.get("alerts", {}).values())
+
+
+def _next_heartbeat_interval(token: str, node: dict, rate: float) -> int:
+    """Interval hint for the node's next heartbeat, in milliseconds:
+    fast while someone watches it, normal while it alerts or restarts,
+    slow when idle; stretched under load and jittered so nodes drift
+    apart instead of reconnecting in lockstep."""
+    if token in WATCHED_NODES:
+        interval = HEARTBEAT_WATCHED_INTERVAL_MS
+    else:
+        alerting = node.get("is_restarting") or _has_active_alert(node)
+        interval = HEARTBEAT_ALERT_INTERVAL_MS if alerting else HEARTBEAT_IDLE_INTERVAL_MS
+        if rate > HEARTBEAT_TARGET_RATE:
+            interval *= rate / HEARTBEAT_TARGET_RATE
+        interval = min(interval, current_config.NODE_OFFLINE_TIMEOUT * 1000 / 2)
+    interval *= 1 + random.uniform(-HEARTBEAT_JITTER, HEARTBEAT_JITTER)
+    return int(interval)
+
+
+def _is_json_compatible(value) -> bool:
+    stack = [value]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, dict):
+            if not all(isinstance(key, str) for key in item):
+                return False
+            stack.extend(item.values())
+        elif isinstance(item, list):
+            stack.extend(item)
+        elif item is not None and not isinstance(item, (str, int, float)):
+            return False
+    return True
+
+
+async def _read_node_request(request):
+    """Guard checks, body decoding and HMAC verification shared by the
+    node HTTP endpoints. Returns (token, data, None), or
+    (None, None, error response)."""
     signature = request.headers.get("X-Signature")
     if not signature:
-        return web.json_response({"error": "Signature missing"}, status=401)
+        return None, None, web.json_response({"error": "Signature missing"}, status=401)
+    rejected = await heartbeat_guard.precheck(request, get_client_ip(request))
+    if rejected:
+        return None, None, web.json_response({"error": rejected[1]}, status=rejected[0])
     try:
         body_bytes = await request.read()
-        data = json.loads(body_bytes)
+        rejected = heartbeat_guard.body_too_large(body_bytes)
+        if rejected:
+            return None, None, web.json_response({"error": rejected[1]}, status=rejected[0])
+        if request.content_type == "application/msgpack" and MSGPACK_AVAILABLE:
+            data = msgpack.unpackb(body_bytes, raw=False)
+            # bin/ext values and non-string keys would later break the
+            # JSON columns the payload is stored in
+            if not _is_json_compatible(data):
+                raise ValueError("payload is not JSON-compatible")
+        else:
+            data = json.loads(body_bytes)
+        if not isinstance(data, dict):
+            raise ValueError("payload is not an object")
     except Exception:
-        return web.json_response({"error": "Invalid JSON"}, status=400)
+        return None, None, web.json_response({"error": "Invalid JSON"}, status=400)
     token = data.get("token")
     if not token:
-        return web.json_response({"error": "Token missing"}, status=401)
+        return None, None, web.json_response({"error": "Token missing"}, status=401)
     expected_signature = hmac.new(
         token.encode(), body_bytes, hashlib.sha256
     ).hexdigest()
     if not hmac.compare_digest(expected_signature, signature):
         safe_ip = str(request.remote).replace("\n", "").replace("\r", "")
         logging.warning(f"Invalid signature from {mask_sensitive_data(safe_ip)}")
-        return web.json_response({"error": "Invalid signature"}, status=403)
-    node = await nodes_db.get_node_by_token(token)
-    if not node:
+        heartbeat_guard.DROPS["bad_signature"] += 1
+        return None, None, web.json_response({"error": "Invalid signature"}, status=403)
+    rejected = heartbeat_guard.postcheck(request, token, data, signature)
+    if rejected:
+        return None, None, web.json_response({"error": rejected[1]}, status=rejected[0])
+    return token, data, None
+
+
+async def handle_heartbeat(request):
+    token, data, error = await _read_node_request(request)
+    if error is not None:
+        return error
+    response = await process_heartbeat(request, token, data)
+    if response is None:
         return web.json_response({"error": "Auth fail"}, status=401)
+    return web.json_response(response)
+
+
+async def handle_node_backfill(request):
+    """Stats a node spooled while it could not reach the agent, sent as
+    {"samples": [[timestamp, stats], ...]}. They only go to history."""
+    token, data, error = await _read_node_request(request)
+    if error is not None:
+        return error
+    samples = data.get("samples")
+    if not isinstance(samples, list):
+        return web.json_response({"error": "Samples missing"}, status=400)
+    stored = await nodes_db.ingest_backfill(token, samples)
+    if stored is None:
+        return web.json_response({"error": "Auth fail"}, status=401)
+    return web.json_response({"status": "ok", "stored": stored})
+
+
+async def process_heartbeat(request, token: str, data: dict):
+    """Everything after authentication, shared by /api/heartbeat and the
+    node WebSocket. Returns the reply dict, or None for an unknown node."""
+    seq = data.get("seq")
+    if "delta" in data:
+        delta = data["delta"] if isinstance(data["delta"], dict) else {}
+        stats = nodes_db.merge_stats_delta(token, seq, delta)
+        resync = stats is None
+    else:
+        # without stats or delta nothing is sampled: no history point
+        stats = data.get("stats") if "stats" in data else None
+        if stats is not None and not isinstance(stats, dict):
+            stats = {}
+        resync = False
+    ip = request.transport.get_extra_info("peername")[0]
+    if stats and stats.get("external_ip"):
+        ip = stats.get("external_ip")
+    else:
+        try:
+            ip_obj = ipaddress.ip_address(ip)
+            if (
+                    (ip_obj.is_private or ip_obj.is_loopback)
+                    and AGENT_IP_CACHE
+                    and (AGENT_IP_CACHE not in ["Loading...", "Unknown"])
+            ):
+                ip = AGENT_IP_CACHE
+        except ValueError:
+            pass
+    acks = data.get("acks")
+    node, tasks_to_send = await nodes_db.ingest_heartbeat(
+        token, ip, stats, acks if isinstance(acks, list) else None, seq
+    )
+    if not node:
+        return None
     ssh_logins = data.get("ssh_logins", [])
     bot = request.app.get("bot")
-
     if ssh_logins and bot:
-        server_tz = get_server_timezone_label()
-        server_time = time.strftime("%H:%M")
-
+        node_name = node.get("name", "Node")
         for login in ssh_logins:
-            user_ssh = login.get("user", "unknown")
-            ip = login.get("ip", "unknown")
-            method_raw = login.get("method", "unknown")
-            node_time_str = login.get("node_time_str", "??:??")
-            tz_label = login.get("tz_label", "")
-
-            # Логируем с masking
-            logging.info(
-                f"SSH login on node {node.get('name', 'Node')}: user={user_ssh}, ip={mask_sensitive_data(ip)}, method={method_raw}")
-
-            flag = await get_country_flag(ip)
-            method_key = "auth_method_unknown"
-            if "publickey" in method_raw.lower():
-                method_key = "auth_method_key"
-            elif "password" in method_raw.lower():
-                method_key = "auth_method_password"
-
-            await send_alert(
-                bot,
-                lambda lang: _(
-                    "alert_ssh_login_node",
-                    lang,
-                    node_name=node.get('name', 'Node'),
-                    user=user_ssh,
-                    method=_(method_key, lang),
-                    ip_flag=flag,
-                    ip=ip,
-                    node_time=node_time_str,
-                    node_tz=tz_label,
-                    server_time=server_time,
-                    server_tz=server_tz
-                ),
-                "node_logins",
-                node_token=token
-            )
-    stats = data.get("stats", {})
+            if isinstance(login, dict):
+                enqueue_ssh_alert(token, node_name, login)
     results = data.get("results", [])
     if bot and results:
         for res in results:
@@ -943,28 +1078,184 @@ async def handle_heartbeat(request):
                     node.get("name", "Node"),
                 )
             )
-    if node.get("is_restarting"):
-        await nodes_db.update_node_extra(token, "is_restarting", False)
-    ip = request.transport.get_extra_info("peername")[0]
-    if stats.get("external_ip"):
-        ip = stats.get("external_ip")
-    else:
+    response = {
+        "status": "ok",
+        "tasks": tasks_to_send,
+        "proto": HEARTBEAT_PROTO,
+        "formats": HEARTBEAT_FORMATS,
+        "encodings": HEARTBEAT_ENCODINGS,
+        "next_interval_ms": _next_heartbeat_interval(
+            token, node, _track_heartbeat_rate()
+        ),
+        "backfill": "/api/node/backfill",
+    }
+    if resync:
+        response["resync"] = True
+    if token in WATCHED_NODES or _has_active_alert(node):
+        # top-process lists on every heartbeat instead of the node's cache
+        response["live_processes"] = True
+    if NODE_WS_ENABLED:
+        response["ws"] = "/api/node/ws"
+    return response
+
+
+def _read_ws_frame(raw: str, token: str = None):
+    """Node WebSocket frames are {"payload": "<json>", "signature": "<hex>"}
+    with the same HMAC-SHA256 over the payload text as X-Signature on
+    /api/heartbeat. token is None for the first (hello) frame, which
+    names the token itself. Returns the payload dict, or None."""
+    try:
+        frame = json.loads(raw)
+        payload_text = frame["payload"]
+        data = json.loads(payload_text)
+        if not isinstance(data, dict):
+            return None
+    except (ValueError, KeyError, TypeError):
+        return None
+    token = token or data.get("token")
+    signature = frame.get("signature")
+    if not token or not isinstance(signature, str):
+        return None
+    expected = hmac.new(
+        token.encode(), payload_text.encode(), hashlib.sha256
+    ).hexdigest()
+    if not hmac.compare_digest(expected, signature):
+        return None
+    return data
+
+
+async def handle_node_ws(request):
+    """Persistent channel for nodes: heartbeats and results go up, tasks are
+    pushed down as soon as they are queued. Polling stays the fallback."""
+    ws = web.WebSocketResponse(heartbeat=30, max_msg_size=1024 * 1024)
+    await ws.prepare(request)
+    token = None
+    task_event = None
+    pusher = None
+
+    async def push_tasks():
+        while True:
+            await task_event.wait()
+            task_event.clear()
+            tasks = await nodes_db.take_node_tasks(token, [])
+            if tasks:
+                await ws.send_json({"type": "tasks", "tasks": tasks})
+
+    try:
+        async for msg in ws:
+            if msg.type != web.WSMsgType.TEXT:
+                break
+            data = _read_ws_frame(msg.data, token)
+            if data is None:
+                logging.warning(
+                    f"Invalid node WebSocket frame from {mask_sensitive_data(str(request.remote))}"
+                )
+                await ws.close(code=4401, message=b"Invalid signature")
+                break
+            if token is None:
+                timestamp = data.get("timestamp")
+                fresh = (
+                    isinstance(timestamp, (int, float))
+                    and abs(time.time() - timestamp) < NODE_WS_HELLO_MAX_AGE
+                )
+                if (
+                    data.get("type") != "hello"
+                    or not fresh
+                    or not await nodes_db.get_node_by_token(data["token"])
+                ):
+                    await ws.close(code=4401, message=b"Auth fail")
+                    break
+                token = data["token"]
+                task_event = nodes_db.subscribe_tasks(token)
+                task_event.set()
+                pusher = asyncio.create_task(push_tasks())
+                await ws.send_json({"type": "welcome"})
+                continue
+            if data.get("type") == "heartbeat":
+                response = await process_heartbeat(request, token, data)
+                if response is None:
+                    await ws.close(code=4401, message=b"Auth fail")
+                    break
+                await ws.send_json({"type": "heartbeat", **response})
+    except (ConnectionResetError, asyncio.CancelledError):
+        pass
+    except Exception as e:
+        logging.error(f"Node WebSocket error: {e}")
+    finally:
+        if pusher:
+            pusher.cancel()
+        if task_event:
+            nodes_db.unsubscribe_tasks(token, task_event)
+    return ws
+
+
+def enqueue_ssh_alert(token: str, node_name: str, login: dict):
+    logging.info(
+        f"SSH login on node {node_name}: user={login.get('user', 'unknown')}, "
+        f"ip={mask_sensitive_data(login.get('ip', 'unknown'))}, method={login.get('method', 'unknown')}"
+    )
+    item = (token, node_name, login, time.strftime("%H:%M"))
+    try:
+        SSH_ALERT_QUEUE.put_nowait(item)
+    except asyncio.QueueFull:
+        SSH_ALERT_STATS["dropped"] += 1
+        logging.warning(f"SSH alert queue full, dropped login alert for node {node_name}")
+
+
+async def _deliver_ssh_alert(bot, token, node_name, login, server_time):
+    user_ssh = login.get("user", "unknown")
+    ip = login.get("ip", "unknown")
+    method_raw = login.get("method", "unknown")
+    node_time_str = login.get("node_time_str", "??:??")
+    tz_label = login.get("tz_label", "")
+    server_tz = get_server_timezone_label()
+
+    flag = await get_country_flag(ip)
+    method_key = "auth_method_unknown"
+    if "publickey" in method_raw.lower():
+        method_key = "auth_method_key"
+    elif "password" in method_raw.lower():
+        method_key = "auth_method_password"
+
+    await send_alert(
+        bot,
+        lambda lang: _(
+            "alert_ssh_login_node",
+            lang,
+            node_name=node_name,
+            user=user_ssh,
+            method=_(method_key, lang),
+            ip_flag=flag,
+            ip=ip,
+            node_time=node_time_str,
+            node_tz=tz_label,
+            server_time=server_time,
+            server_tz=server_tz
+        ),
+        "node_logins",
+        node_token=token
+    )
+
+
+async def ssh_alert_worker(bot):
+    while True:
+        token, node_name, login, server_time = await SSH_ALERT_QUEUE.get()
         try:
-            ip_obj = ipaddress.ip_address(ip)
-            if (
-                    (ip_obj.is_private or ip_obj.is_loopback)
-                    and AGENT_IP_CACHE
-                    and (AGENT_IP_CACHE not in ["Loading...", "Unknown"])
-            ):
-                ip = AGENT_IP_CACHE
-        except ValueError:
-            pass
-    await nodes_db.update_node_heartbeat(token, ip, stats)
-    current_node = await nodes_db.get_node_by_token(token)
-    tasks_to_send = current_node.get("tasks", [])
-    if tasks_to_send:
-        await nodes_db.clear_node_tasks(token)
-    return web.json_response({"status": "ok", "tasks": tasks_to_send})
+            await _deliver_ssh_alert(bot, token, node_name, login, server_time)
+            SSH_ALERT_STATS["sent"] += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"SSH alert delivery failed for node {node_name}: {e}")
+        finally:
+            SSH_ALERT_QUEUE.task_done()
+
+
+def start_ssh_alert_workers(bot):
+    for i in range(SSH_ALERT_WORKERS):
+        SSH_ALERT_TASKS.append(
+            asyncio.create_task(ssh_alert_worker(bot), name=f"SshAlertWorker-{i}")
+        )
 
 
 async def process_node_result_background(bot, user_id, cmd, text, token, node_name):
@@ -1045,12 +1336,18 @@ async def handle_node_details(request):
     node = await nodes_db.get_node_by_token(token)
     if not node:
         return web.json_response({"error": "Node not found"}, status=404)
+    try:
+        resolution = int(request.query.get("resolution", 0))
+        points = int(request.query.get("points", nodes_db.HISTORY_POINTS))
+    except ValueError:
+        return web.json_response({"error": "Invalid history range"}, status=400)
+    history = await nodes_db.get_node_history(token, resolution, points)
     return web.json_response(
         {
             "name": node.get("name"),
             "ip": encrypt_for_web(node.get("ip")),
             "stats": node.get("stats"),
-            "history": node.get("history", []),
+            "history": history,
             "token": encrypt_for_web(token),
             "last_seen": node.get("last_seen", 0),
             "is_restarting": node.get("is_restarting", False),
@@ -1264,34 +1561,67 @@ async def handle_node_rename(request):
         return web.json_response({"error": str(e)}, status=500)
 
 
+def _parse_nodes_query(query) -> dict:
+    """?status=, ?sort= and ?limit= of the node list; raises ValueError."""
+    params = {}
+    status = query.get("status")
+    if status:
+        if status not in nodes_db.NODE_STATUSES:
+            raise ValueError(f"Unknown status: {status}")
+        params["status"] = status
+    sort = query.get("sort")
+    if sort:
+        if sort.lstrip("-") not in nodes_db.NODE_SORT_FIELDS:
+            raise ValueError(f"Unknown sort field: {sort}")
+        params["sort"] = sort
+    limit = query.get("limit")
+    if limit:
+        params["limit"] = int(limit)
+        if params["limit"] <= 0:
+            raise ValueError("limit must be positive")
+    return params
+
+
+async def _build_nodes_payload(status=None, sort=None, limit=None) -> dict:
+    all_nodes = await nodes_db.get_nodes_summary(status, sort, limit)
+    nodes_data = [
+        {
+            "token": encrypt_for_web(token),
+            "name": node.get("name", "Unknown"),
+            "ip": encrypt_for_web(node.get("ip", "Unknown")),
+            "status": node["status"],
+            "cpu": node.get("cpu", 0),
+            "ram": node.get("ram", 0),
+            "disk": node.get("disk", 0),
+        }
+        for token, node in all_nodes.items()
+    ]
+    return {"nodes": nodes_data, "counts": await nodes_db.count_nodes_by_status()}
+
+
 async def handle_nodes_list_json(request):
     user = get_current_user(request)
     if not user:
         return web.json_response({"error": "Unauthorized"}, status=401)
-    all_nodes = await nodes_db.get_all_nodes()
-    nodes_data = []
-    now = time.time()
-    for token, node in all_nodes.items():
-        last_seen = node.get("last_seen", 0)
-        is_restarting = node.get("is_restarting", False)
-        status = "offline"
-        if is_restarting:
-            status = "restarting"
-        elif now - last_seen < NODE_OFFLINE_TIMEOUT:
-            status = "online"
-        stats = node.get("stats", {})
-        nodes_data.append(
-            {
-                "token": encrypt_for_web(token),
-                "name": node.get("name", "Unknown"),
-                "ip": encrypt_for_web(node.get("ip", "Unknown")),
-                "status": status,
-                "cpu": stats.get("cpu", 0),
-                "ram": stats.get("ram", 0),
-                "disk": stats.get("disk", 0),
-            }
-        )
-    return web.json_response({"nodes": nodes_data})
+    try:
+        params = _parse_nodes_query(request.query)
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=400)
+    return web.json_response(await _build_nodes_payload(**params))
+
+
+async def handle_heartbeat_stats(request):
+    user = get_current_user(request)
+    if not user or user["role"] != "admins":
+        return web.json_response({"error": "Forbidden"}, status=403)
+    return web.json_response(
+        {
+            "guard": heartbeat_guard.get_stats(),
+            "rate_per_sec": round(HEARTBEAT_RATE["rate"], 2),
+            "ssh_alerts": {**SSH_ALERT_STATS, "queued": SSH_ALERT_QUEUE.qsize()},
+            "node_cache": nodes_db.get_cache_stats(),
+        }
+    )
 
 
 async def handle_settings_page(request):
@@ -1323,7 +1653,7 @@ async def handle_settings_page(request):
             if uid != ADMIN_USER_ID
         ]
         users_json = json.dumps(ulist)
-        all_nodes = await nodes_db.get_all_nodes()
+        all_nodes = await nodes_db.get_nodes_summary()
         nlist = [
             {
                 "token": encrypt_for_web(t),
@@ -2081,6 +2411,10 @@ async def handle_sse_stream(request):
     import psutil
 
     uid = user["id"]
+    try:
+        nodes_query = _parse_nodes_query(request.query)
+    except ValueError:
+        nodes_query = {}
     try:
         while True:
             if shared_state.IS_RESTARTING:
@@ -2156,32 +2490,10 @@ async def handle_sse_stream(request):
                 )
             except (ConnectionResetError, BrokenPipeError, ConnectionError):
                 break
-            all_nodes = await nodes_db.get_all_nodes()
-            nodes_data = []
-            now = time.time()
-            for token, node in all_nodes.items():
-                last_seen = node.get("last_seen", 0)
-                is_restarting = node.get("is_restarting", False)
-                status = "offline"
-                if is_restarting:
-                    status = "restarting"
-                elif now - last_seen < NODE_OFFLINE_TIMEOUT:
-                    status = "online"
-                stats = node.get("stats", {})
-                nodes_data.append(
-                    {
-                        "token": encrypt_for_web(token),
-                        "name": node.get("name", "Unknown"),
-                        "ip": encrypt_for_web(node.get("ip", "Unknown")),
-                        "status": status,
-                        "cpu": stats.get("cpu", 0),
-                        "ram": stats.get("ram", 0),
-                        "disk": stats.get("disk", 0),
-                    }
-                )
+            nodes_payload = await _build_nodes_payload(**nodes_query)
             try:
                 await resp.write(
-                    f"event: nodes_list\ndata: {json.dumps({'nodes': nodes_data})}\n\n".encode(
+                    f"event: nodes_list\ndata: {json.dumps(nodes_payload)}\n\n".encode(
                         "utf-8"
                     )
                 )
@@ -2442,6 +2754,7 @@ async def handle_sse_node_details(request):
     resp.headers["Connection"] = "keep-alive"
     await resp.prepare(request)
     shutdown_event = request.app.get("shutdown_event")
+    WATCHED_NODES[token] = WATCHED_NODES.get(token, 0) + 1
     try:
         while True:
             if shared_state.IS_RESTARTING:
@@ -2461,7 +2774,7 @@ async def handle_sse_node_details(request):
                     "name": node.get("name"),
                     "ip": encrypt_for_web(node.get("ip")),
                     "stats": node.get("stats"),
-                    "history": node.get("history", []),
+                    "history": await nodes_db.get_node_history(token),
                     "token": encrypt_for_web(token),
                     "last_seen": node.get("last_seen", 0),
                     "is_restarting": node.get("is_restarting", False),
@@ -2498,6 +2811,11 @@ async def handle_sse_node_details(request):
     except Exception as e:
         if "closing transport" not in str(e) and "'NoneType' object" not in str(e):
             logging.error(f"SSE Node Details Error: {e}")
+    finally:
+        if WATCHED_NODES.get(token, 0) <= 1:
+            WATCHED_NODES.pop(token, None)
+        else:
+            WATCHED_NODES[token] -= 1
     return resp
 
 
@@ -2509,6 +2827,10 @@ async def cleanup_server():
             await AGENT_TASK
         except asyncio.CancelledError:
             pass
+    for task in SSH_ALERT_TASKS:
+        task.cancel()
+    await asyncio.gather(*SSH_ALERT_TASKS, return_exceptions=True)
+    SSH_ALERT_TASKS.clear()
 
 
 async def cleanup_monitor():
@@ -2622,6 +2944,9 @@ async def start_web_server(bot_instance: Bot):
 
     app.on_shutdown.append(on_shutdown)
     app.router.add_post("/api/heartbeat", handle_heartbeat)
+    app.router.add_post("/api/node/backfill", handle_node_backfill)
+    if NODE_WS_ENABLED:
+        app.router.add_get("/api/node/ws", handle_node_ws)
     if ENABLE_WEB_UI:
         logging.info("Web UI ENABLED.")
         if os.path.exists(STATIC_DIR):
@@ -2648,6 +2973,7 @@ async def start_web_server(bot_instance: Bot):
         app.router.add_get("/api/node/details", handle_node_details)
         app.router.add_get("/api/agent/stats", handle_agent_stats)
         app.router.add_get("/api/nodes/list", handle_nodes_list_json)
+        app.router.add_get("/api/nodes/heartbeat_stats", handle_heartbeat_stats)
         app.router.add_get("/api/logs", handle_get_logs)
         app.router.add_get("/api/logs/system", handle_get_sys_logs)
         app.router.add_post("/api/settings/save", handle_save_notifications)
@@ -2679,6 +3005,7 @@ async def start_web_server(bot_instance: Bot):
         logging.info("Web UI DISABLED.")
         app.router.add_get("/", handle_api_root)
     AGENT_TASK = asyncio.create_task(agent_monitor())
+    start_ssh_alert_workers(bot_instance)
     asyncio.create_task(cleanup_monitor())
     runner = web.AppRunner(app, access_log=True, shutdown_timeout=1.0)
     await runner.setup()
@@ -2695,12 +3022,11 @@ async def start_web_server(bot_instance: Bot):
 async def agent_monitor():
     global AGENT_IP_CACHE, AGENT_FLAG
     import psutil
-    import requests
 
     try:
-        AGENT_IP_CACHE = await asyncio.to_thread(
-            lambda: requests.get("https://api.ipify.org", timeout=3).text
-        )
+        ip = await asyncio.to_thread(IP_RESOLVER.resolve)
+        if ip:
+            AGENT_IP_CACHE = ip
     except Exception:
         pass
     try:
@@ -2709,6 +3035,11 @@ async def agent_monitor():
         pass
     while True:
         try:
+            # cached; refreshed in the background once the TTL runs out
+            ip = IP_RESOLVER.get()
+            if ip and ip != AGENT_IP_CACHE:
+                AGENT_FLAG = await get_country_flag(ip)
+                AGENT_IP_CACHE = ip
             cpu = psutil.cpu_percent(interval=None)
             ram = psutil.virtual_memory().percent
             net = psutil.net_io_counters()
@@ -3238,6 +3569,10 @@ async def handle_sse_stream(request):
     import psutil
 
     uid = user["id"]
+    try:
+        nodes_query = _parse_nodes_query(request.query)
+    except ValueError:
+        nodes_query = {}
     try:
         while True:
             if shared_state.IS_RESTARTING:
@@ -3313,32 +3648,10 @@ async def handle_sse_stream(request):
                 )
             except (ConnectionResetError, BrokenPipeError, ConnectionError):
                 break
-            all_nodes = await nodes_db.get_all_nodes()
-            nodes_data = []
-            now = time.time()
-            for token, node in all_nodes.items():
-                last_seen = node.get("last_seen", 0)
-                is_restarting = node.get("is_restarting", False)
-                status = "offline"
-                if is_restarting:
-                    status = "restarting"
-                elif now - last_seen < NODE_OFFLINE_TIMEOUT:
-                    status = "online"
-                stats = node.get("stats", {})
-                nodes_data.append(
-                    {
-                        "token": encrypt_for_web(token),
-                        "name": node.get("name", "Unknown"),
-                        "ip": encrypt_for_web(node.get("ip", "Unknown")),
-                        "status": status,
-                        "cpu": stats.get("cpu", 0),
-                        "ram": stats.get("ram", 0),
-                        "disk": stats.get("disk", 0),
-                    }
-                )
+            nodes_payload = await _build_nodes_payload(**nodes_query)
             try:
                 await resp.write(
-                    f"event: nodes_list\ndata: {json.dumps({'nodes': nodes_data})}\n\n".encode(
+                    f"event: nodes_list\ndata: {json.dumps(nodes_payload)}\n\n".encode(
                         "utf-8"
                     )
                 )
@@ -3597,6 +3910,7 @@ async def handle_sse_node_details(request):
     resp.headers["Connection"] = "keep-alive"
     await resp.prepare(request)
     shutdown_event = request.app.get("shutdown_event")
+    WATCHED_NODES[token] = WATCHED_NODES.get(token, 0) + 1
     try:
         while True:
             if shared_state.IS_RESTARTING:
@@ -3616,7 +3930,7 @@ async def handle_sse_node_details(request):
                     "name": node.get("name"),
                     "ip": encrypt_for_web(node.get("ip")),
                     "stats": node.get("stats"),
-                    "history": node.get("history", []),
+                    "history": await nodes_db.get_node_history(token),
                     "token": encrypt_for_web(token),
                     "last_seen": node.get("last_seen", 0),
                     "is_restarting": node.get("is_restarting", False),
@@ -3653,6 +3967,11 @@ async def handle_sse_node_details(request):
     except Exception as e:
         if "closing transport" not in str(e) and "'NoneType' object" not in str(e):
             logging.error(f"SSE Node Details Error: {e}")
+    finally:
+        if WATCHED_NODES.get(token, 0) <= 1:
+            WATCHED_NODES.pop(token, None)
+        else:
+            WATCHED_NODES[token] -= 1
     return resp
 
 
@@ -3880,6 +4199,10 @@ async def cleanup_server():
             await AGENT_TASK
         except asyncio.CancelledError:
             pass
+    for task in SSH_ALERT_TASKS:
+        task.cancel()
+    await asyncio.gather(*SSH_ALERT_TASKS, return_exceptions=True)
+    SSH_ALERT_TASKS.clear()
 
 
 async def start_web_server(bot_instance: Bot):
@@ -3893,6 +4216,9 @@ async def start_web_server(bot_instance: Bot):
 
     app.on_shutdown.append(on_shutdown)
     app.router.add_post("/api/heartbeat", handle_heartbeat)
+    app.router.add_post("/api/node/backfill", handle_node_backfill)
+    if NODE_WS_ENABLED:
+        app.router.add_get("/api/node/ws", handle_node_ws)
     if ENABLE_WEB_UI:
         logging.info("Web UI ENABLED.")
         if os.path.exists(STATIC_DIR):
@@ -3920,6 +4246,7 @@ async def start_web_server(bot_instance: Bot):
         app.router.add_get("/api/node/details", handle_node_details)
         app.router.add_get("/api/agent/stats", handle_agent_stats)
         app.router.add_get("/api/nodes/list", handle_nodes_list_json)
+        app.router.add_get("/api/nodes/heartbeat_stats", handle_heartbeat_stats)
         app.router.add_get("/api/logs", handle_get_logs)
         app.router.add_get("/api/logs/system", handle_get_sys_logs)
         app.router.add_post("/api/settings/save", handle_save_notifications)
@@ -3957,6 +4284,7 @@ async def start_web_server(bot_instance: Bot):
         logging.info("Web UI DISABLED.")
         app.router.add_get("/", handle_api_root)
     AGENT_TASK = asyncio.create_task(agent_monitor())
+    start_ssh_alert_workers(bot_instance)
     runner = web.AppRunner(app, access_log=None, shutdown_timeout=1.0)
     await runner.setup()
     site = web.TCPSite(runner, WEB_SERVER_HOST, WEB_SERVER_PORT)
@@ -3972,12 +4300,11 @@ async def start_web_server(bot_instance: Bot):
 async def agent_monitor():
     global AGENT_IP_CACHE, AGENT_FLAG
     import psutil
-    import requests
 
     try:
-        AGENT_IP_CACHE = await asyncio.to_thread(
-            lambda: requests.get("https://api.ipify.org", timeout=3).text
-        )
+        ip = await asyncio.to_thread(IP_RESOLVER.resolve)
+        if ip:
+            AGENT_IP_CACHE = ip
     except Exception:
         pass
     try:
@@ -3986,6 +4313,11 @@ async def agent_monitor():
         pass
     while True:
         try:
+            # cached; refreshed in the background once the TTL runs out
+            ip = IP_RESOLVER.get()
+            if ip and ip != AGENT_IP_CACHE:
+                AGENT_FLAG = await get_country_flag(ip)
+                AGENT_IP_CACHE = ip
             cpu = psutil.cpu_percent(interval=None)
             ram = psutil.virtual_memory().percent
             net = psutil.net_io_counters()
@@ -0,0 +1,248 @@
+import time
+import json
+import hmac
+import random
+import asyncio
+import hashlib
+import aiohttp
+from . import nodes_db
+from .benchmark import _percentile
+
+SIM_PREFIX = "sim-"
+SIM_COMMAND = "sim_ping"
+
+
+class VirtualNode:
+    """One simulated node agent: random-walk stats, the delta heartbeat
+    protocol, acks and command results, signed like node/node.py."""
+
+    def __init__(self, token: str, index: int, ssh_rate: float):
+        self.token = token
+        self.node_id = hashlib.sha256(token.encode()).hexdigest()
+        self.rng = random.Random(index)
+        self.ssh_rate = ssh_rate
+        self.seq = 0
+        self.last_sent = None
+        self.acks = []
+        self.results = []
+        self.next_interval = None
+        self.cpu = self.rng.uniform(2, 30)
+        self.ram = self.rng.uniform(20, 60)
+        self.disk = self.rng.uniform(10, 80)
+        self.net_rx = self.rng.randint(10**6, 10**9)
+        self.net_tx = self.rng.randint(10**6, 10**9)
+        self.started = time.time() - self.rng.randint(3600, 90 * 86400)
+        self.ip = f"198.51.100.{index % 254 + 1}"
+
+    def _stats(self) -> dict:
+        self.cpu = min(100.0, max(0.0, self.cpu + self.rng.gauss(0, 5)))
+        self.ram = min(100.0, max(0.0, self.ram + self.rng.gauss(0, 1)))
+        self.disk = min(100.0, self.disk + self.rng.random() * 0.001)
+        self.net_rx += self.rng.randint(10**3, 10**6)
+        self.net_tx += self.rng.randint(10**3, 10**6)
+        return {
+            "cpu": round(self.cpu, 1),
+            "ram": round(self.ram, 1),
+            "disk": round(self.disk, 1),
+            "ram_total": 2084327424,
+            "ram_free": int(2084327424 * (1 - self.ram / 100)),
+            "disk_total": 42140401664,
+            "disk_free": int(42140401664 * (1 - self.disk / 100)),
+            "cpu_freq": 2394.45,
+            "net_rx": self.net_rx,
+            "net_tx": self.net_tx,
+            "uptime": int(time.time() - self.started),
+            "process_cpu": f"python3 ({round(self.cpu / 3, 1)}%), xray (1.2%), sshd (0.4%)",
+            "process_ram": "xray (9.8%), python3 (4.2%), systemd (0.7%)",
+            "external_ip": self.ip,
+        }
+
+    def _ssh_events(self) -> list:
+        if not self.ssh_rate or self.rng.random() >= self.ssh_rate:
+            return []
+        return [
+            {
+                "user": "root",
+                "ip": f"203.0.113.{self.rng.randint(1, 254)}",
+                "method": self.rng.choice(["publickey", "password"]),
+                "node_time_str": time.strftime("%H:%M"),
+                "tz_label": "UTC",
+            }
+        ]
+
+    def build(self):
+        stats = self._stats()
+        self.seq += 1
+        payload = {
+            "token": self.token,
+            "results": self.results,
+            "ssh_logins": self._ssh_events(),
+            "acks": self.acks,
+            "seq": self.seq,
+            "timestamp": int(time.time()),
+        }
+        if self.last_sent is None:
+            payload["stats"] = stats
+        else:
+            payload["delta"] = {
+                k: v for k, v in stats.items() if self.last_sent.get(k) != v
+            }
+        body = json.dumps(payload, sort_keys=True).encode()
+        headers = {
+            "Content-Type": "application/json",
+            "X-Signature": hmac.new(
+                self.token.encode(), body, hashlib.sha256
+            ).hexdigest(),
+            "X-Node-Id": self.node_id,
+            "X-Timestamp": str(payload["timestamp"]),
+        }
+        return body, headers, stats
+
+    def handle_reply(self, data: dict, stats: dict, report: "SimReport"):
+        self.results = []
+        self.acks = []
+        if data.get("proto", 1) >= 2 and not data.get("resync"):
+            self.last_sent = stats
+        else:
+            self.last_sent = None
+        self.next_interval = data.get("next_interval_ms")
+        now = time.time()
+        for task in data.get("tasks", []):
+            if task.get("id") is not None:
+                self.acks.append(task["id"])
+            if task.get("command") == SIM_COMMAND and "sim_sent_at" in task:
+                report.task_delays.append(now - task["sim_sent_at"])
+            self.results.append(
+                {"command": task.get("command"), "user_id": None, "result": "pong"}
+            )
+
+
+class SimReport:
+    def __init__(self):
+        self.latencies = []
+        self.statuses = {}
+        self.errors = {}
+        self.task_delays = []
+        self.tasks_sent = 0
+
+    def to_dict(self, nodes: int, duration: float) -> dict:
+        requests_total = len(self.latencies) + sum(self.errors.values())
+        failed = sum(self.errors.values()) + sum(
+            count for status, count in self.statuses.items() if status != 200
+        )
+        ms = lambda seconds: round(seconds * 1000, 2)  # noqa: E731
+        return {
+            "nodes": nodes,
+            "duration_sec": round(duration, 1),
+            "requests": requests_total,
+            "requests_per_sec": round(requests_total / duration, 1) if duration else 0,
+            "statuses": {str(k): v for k, v in sorted(self.statuses.items())},
+            "errors": self.errors,
+            "error_rate": round(failed / requests_total, 4) if requests_total else 0,
+            "latency_ms": {
+                "p50": ms(_percentile(self.latencies, 0.5)),
+                "p90": ms(_percentile(self.latencies, 0.9)),
+                "p99": ms(_percentile(self.latencies, 0.99)),
+                "max": ms(max(self.latencies, default=0)),
+            },
+            "tasks": {
+                "sent": self.tasks_sent,
+                "delivered": len(self.task_delays),
+                "delay_p50_ms": ms(_percentile(self.task_delays, 0.5)),
+                "delay_p99_ms": ms(_percentile(self.task_delays, 0.99)),
+                "delay_max_ms": ms(max(self.task_delays, default=0)),
+            },
+        }
+
+
+async def _run_node(session, url, node, report, deadline, interval, obey_hints):
+    await asyncio.sleep(node.rng.uniform(0, interval))
+    while time.time() < deadline:
+        body, headers, stats = node.build()
+        started = time.perf_counter()
+        try:
+            async with session.post(url, data=body, headers=headers) as resp:
+                data = await resp.json(content_type=None)
+                report.latencies.append(time.perf_counter() - started)
+                report.statuses[resp.status] = report.statuses.get(resp.status, 0) + 1
+                if resp.status == 200:
+                    node.handle_reply(data, stats, report)
+                else:
+                    node.last_sent = None
+        except Exception as e:
+            name = type(e).__name__
+            report.errors[name] = report.errors.get(name, 0) + 1
+            node.last_sent = None
+        wait = interval
+        if obey_hints and isinstance(node.next_interval, (int, float)):
+            wait = node.next_interval / 1000
+        await asyncio.sleep(max(0.1, wait))
+
+
+async def _inject_tasks(tokens, report, deadline, task_interval):
+    rng = random.Random(0)
+    while time.time() < deadline:
+        await asyncio.sleep(task_interval)
+        token = rng.choice(tokens)
+        await nodes_db.update_node_task(
+            token, {"command": SIM_COMMAND, "sim_sent_at": time.time()}
+        )
+        report.tasks_sent += 1
+
+
+async def prepare_nodes(count: int) -> tuple:
+    """Returns (tokens, created) for `count` nodes named sim-NNNN in
+    nodes.db, creating the missing ones. This runs outside the server
+    process: the server picks the changes up through
+    nodes_db.sync_external_changes() within NODES_DB_FLUSH_INTERVAL."""
+    existing = {
+        node["name"]: token
+        for token, node in (await nodes_db.get_nodes_summary()).items()
+        if str(node.get("name", "")).startswith(SIM_PREFIX)
+    }
+    tokens = []
+    created = 0
+    for i in range(count):
+        name = f"{SIM_PREFIX}{i:04d}"
+        token = existing.get(name)
+        if token is None:
+            token = await nodes_db.create_node(name)
+            created += 1
+        tokens.append(token)
+    return tokens, created
+
+
+async def remove_nodes() -> int:
+    removed = 0
+    for token, node in (await nodes_db.get_nodes_summary()).items():
+        if str(node.get("name", "")).startswith(SIM_PREFIX):
+            await nodes_db.delete_node(token)
+            removed += 1
+    return removed
+
+
+async def run(
+    url: str,
+    tokens: list,
+    duration: float,
+    interval: float = 5,
+    task_interval: float = 1,
+    ssh_rate: float = 0,
+    obey_hints: bool = True,
+    concurrency: int = 200,
+) -> dict:
+    report = SimReport()
+    nodes = [VirtualNode(token, i, ssh_rate) for i, token in enumerate(tokens)]
+    deadline = time.time() + duration
+    started = time.time()
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=5)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        jobs = [
+            _run_node(session, url, node, report, deadline, interval, obey_hints)
+            for node in nodes
+        ]
+        if task_interval:
+            jobs.append(_inject_tasks(tokens, report, deadline, task_interval))
+        await asyncio.gather(*jobs)
+    return report.to_dict(len(nodes), time.time() - started)
@@ -435,7 +435,14 @@ function initSSE() {
 
     resetConnectionWatchdog();
 
-    sseSource = new EventSource('/api/events');
+    // status/sort/limit of the page URL narrow the node list on the server
+    const pageParams = new URLSearchParams(window.location.search);
+    const nodesParams = new URLSearchParams();
+    ['status', 'sort', 'limit'].forEach(key => {
+        if (pageParams.get(key)) nodesParams.set(key, pageParams.get(key));
+    });
+    const nodesQuery = nodesParams.toString();
+    sseSource = new EventSource('/api/events' + (nodesQuery ? `?${nodesQuery}` : ''));
 
     sseSource.onopen = () => {
         isSseConnected = true;
@@ -2,6 +2,10 @@
 
 let chartRes = null;
 let chartNet = null;
+let chartLoad = null;
+let chartDisk = null;
+let chartNics = null;
+let chartMounts = null;
 let nodeSSESource = null;
 let logSSESource = null;
 let servicesSSESource = null;
@@ -278,11 +282,12 @@ function updateNodesListUI(data) {
             }
         }
 
+        const counts = data.counts || {};
         if (document.getElementById('nodesTotal')) {
-            document.getElementById('nodesTotal').innerText = allNodesData.length;
+            document.getElementById('nodesTotal').innerText = counts.total ?? allNodesData.length;
         }
         if (document.getElementById('nodesActive')) {
-            document.getElementById('nodesActive').innerText = allNodesData.filter(n => n.status === 'online').length;
+            document.getElementById('nodesActive').innerText = counts.online ?? allNodesData.filter(n => n.status === 'online').length;
         }
     } catch (e) {
         console.error("Nodes UI update error:", e);
@@ -555,7 +560,7 @@ function updateChartsColors() {
     const isDark = document.documentElement.classList.contains('dark');
     const gridColor = isDark ? 'rgba(255, 255, 255, 0.05)' : 'rgba(0, 0, 0, 0.05)';
     const tickColor = isDark ? '#9ca3af' : '#6b7280';
-    [agentChart, chartRes, chartNet].forEach(chart => {
+    [agentChart, chartRes, chartNet, chartLoad, chartDisk, chartNics, chartMounts].forEach(chart => {
         if (chart) {
             chart.options.scales.x.grid.color = 'transparent';
             chart.options.scales.x.ticks.color = tickColor;
@@ -958,10 +963,15 @@ async function openNodeDetails(token, color) {
         cancelNodeRename();
     }
 
-    if (chartRes) chartRes.destroy();
-    if (chartNet) chartNet.destroy();
+    [chartRes, chartNet, chartLoad, chartDisk, chartNics, chartMounts].forEach(chart => {
+        if (chart) chart.destroy();
+    });
     chartRes = null;
     chartNet = null;
+    chartLoad = null;
+    chartDisk = null;
+    chartNics = null;
+    chartMounts = null;
     if (nodeSSESource) {
         nodeSSESource.close();
         nodeSSESource = null;
@@ -1041,7 +1051,7 @@ function updateNodeDetailsUI(data) {
         lsEl.innerText = diff < 60 ? statusOnline : `${statusLastSeen}${new Date(lastSeen * 1000).toLocaleString()}`;
         lsEl.className = diff < 60 ? "text-green-500 font-bold text-xs" : "text-red-500 font-bold text-xs";
     }
-    renderCharts(data.history);
+    renderCharts(data.history, stats);
 }
 
 function closeNodeModal() {
@@ -1126,7 +1136,7 @@ window.handleRenameKeydown = function(event) {
     }
 };
 
-function renderCharts(history) {
+function renderCharts(history, stats) {
     if (!history || history.length < 2) return;
 
     const ctxRes = document.getElementById('nodeResChart').getContext('2d');
@@ -1138,6 +1148,19 @@ function renderCharts(history) {
     const ramData = [];
     const netRx = [];
     const netTx = [];
+    const load1 = [];
+    const load5 = [];
+    const load15 = [];
+    const diskRead = [];
+    const diskWrite = [];
+    // load is [1, 5, 15 min]; disk_io is [reads/s, writes/s, read B/s, write B/s]
+    const pushIo = (point) => {
+        load1.push(point && point.load ? point.load[0] : null);
+        load5.push(point && point.load ? point.load[1] : null);
+        load15.push(point && point.load ? point.load[2] : null);
+        diskRead.push(point && point.disk_io ? point.disk_io[2] : null);
+        diskWrite.push(point && point.disk_io ? point.disk_io[3] : null);
+    };
 
     labels.push(new Date(history[0].t * 1000).toLocaleTimeString([], {
         hour: '2-digit',
@@ -1148,6 +1171,7 @@ function renderCharts(history) {
     ramData.push(history[0].r);
     netRx.push(0);
     netTx.push(0);
+    pushIo(history[0]);
 
     for (let i = 1; i < history.length; i++) {
         const dt = history[i].t - history[i - 1].t;
@@ -1157,6 +1181,7 @@ function renderCharts(history) {
             ramData.push(null);
             netRx.push(null);
             netTx.push(null);
+            pushIo(null);
         }
         labels.push(new Date(history[i].t * 1000).toLocaleTimeString([], {
             hour: '2-digit',
@@ -1165,8 +1190,15 @@ function renderCharts(history) {
         }));
         cpuData.push(history[i].c);
         ramData.push(history[i].r);
-        netRx.push((Math.max(0, history[i].rx - history[i - 1].rx) * 8 / dt / 1024));
-        netTx.push((Math.max(0, history[i].tx - history[i - 1].tx) * 8 / dt / 1024));
+        // newer nodes send rates they computed themselves (reboot/wrap safe)
+        if (history[i].net_rate) {
+            netRx.push(history[i].net_rate[0] * 8 / 1024);
+            netTx.push(history[i].net_rate[1] * 8 / 1024);
+        } else {
+            netRx.push((Math.max(0, history[i].rx - history[i - 1].rx) * 8 / dt / 1024));
+            netTx.push((Math.max(0, history[i].tx - history[i - 1].tx) * 8 / dt / 1024));
+        }
+        pushIo(history[i]);
     }
 
     const isDark = document.documentElement.classList.contains('dark');
@@ -1302,6 +1334,157 @@ function renderCharts(history) {
             options: netOpts
         });
     }
+
+    renderIoCharts(history, stats || {}, labels, {
+        load1,
+        load5,
+        load15,
+        diskRead,
+        diskWrite
+    }, commonOptions);
+}
+
+function renderIoCharts(history, stats, labels, series, commonOptions) {
+    const container = document.getElementById('nodeIoCharts');
+    if (!container) return;
+    const hasIo = history.some(p => p.load || p.disk_io) || stats.nics || stats.mounts;
+    container.classList.toggle('hidden', !hasIo);
+    if (!hasIo) return;
+
+    const lblRead = (typeof I18N !== 'undefined' && I18N.web_label_read) ? I18N.web_label_read : "Read";
+    const lblWrite = (typeof I18N !== 'undefined' && I18N.web_label_write) ? I18N.web_label_write : "Write";
+    const lblDisk = (typeof I18N !== 'undefined' && I18N.web_label_disk) ? I18N.web_label_disk : "Disk";
+
+    if (chartLoad) {
+        chartLoad.data.labels = labels;
+        chartLoad.data.datasets[0].data = series.load1;
+        chartLoad.data.datasets[1].data = series.load5;
+        chartLoad.data.datasets[2].data = series.load15;
+        chartLoad.update();
+    } else {
+        chartLoad = new Chart(document.getElementById('nodeLoadChart').getContext('2d'), {
+            type: 'line',
+            data: {
+                labels,
+                datasets: [{
+                    label: '1m',
+                    data: series.load1,
+                    borderColor: '#f59e0b',
+                    borderWidth: 2
+                }, {
+                    label: '5m',
+                    data: series.load5,
+                    borderColor: '#3b82f6',
+                    borderWidth: 2
+                }, {
+                    label: '15m',
+                    data: series.load15,
+                    borderColor: '#a855f7',
+                    borderWidth: 2
+                }]
+            },
+            options: JSON.parse(JSON.stringify(commonOptions))
+        });
+    }
+
+    if (chartDisk) {
+        chartDisk.data.labels = labels;
+        chartDisk.data.datasets[0].data = series.diskRead;
+        chartDisk.data.datasets[1].data = series.diskWrite;
+        chartDisk.update();
+    } else {
+        const diskOpts = JSON.parse(JSON.stringify(commonOptions));
+        diskOpts.scales.y.ticks.callback = (v) => `${formatBytes(v)}/s`;
+        const ctxDisk = document.getElementById('nodeDiskChart').getContext('2d');
+        chartDisk = new Chart(ctxDisk, {
+            type: 'line',
+            data: {
+                labels,
+                datasets: [{
+                    label: lblRead,
+                    data: series.diskRead,
+                    borderColor: '#22c55e',
+                    borderWidth: 2,
+                    backgroundColor: getGradient(ctxDisk, 'rgb(34, 197, 94)'),
+                    fill: true
+                }, {
+                    label: lblWrite,
+                    data: series.diskWrite,
+                    borderColor: '#ef4444',
+                    borderWidth: 2,
+                    backgroundColor: getGradient(ctxDisk, 'rgb(239, 68, 68)'),
+                    fill: true
+                }]
+            },
+            options: diskOpts
+        });
+    }
+
+    // per-NIC and per-mount values only exist for the latest heartbeat
+    const nics = stats.nics || {};
+    const nicNames = Object.keys(nics);
+    const nicRx = nicNames.map(name => nics[name][0] * 8 / 1024);
+    const nicTx = nicNames.map(name => nics[name][1] * 8 / 1024);
+    if (chartNics) {
+        chartNics.data.labels = nicNames;
+        chartNics.data.datasets[0].data = nicRx;
+        chartNics.data.datasets[1].data = nicTx;
+        chartNics.update();
+    } else {
+        const nicOpts = barOptions(commonOptions);
+        nicOpts.scales.x.ticks.callback = (v) => formatSpeed(v);
+        chartNics = new Chart(document.getElementById('nodeNicsChart').getContext('2d'), {
+            type: 'bar',
+            data: {
+                labels: nicNames,
+                datasets: [{
+                    label: 'RX',
+                    data: nicRx,
+                    backgroundColor: '#22c55e'
+                }, {
+                    label: 'TX',
+                    data: nicTx,
+                    backgroundColor: '#ef4444'
+                }]
+            },
+            options: nicOpts
+        });
+    }
+
+    const mounts = stats.mounts || {};
+    const mountNames = Object.keys(mounts);
+    const mountUsage = mountNames.map(name => mounts[name]);
+    if (chartMounts) {
+        chartMounts.data.labels = mountNames;
+        chartMounts.data.datasets[0].data = mountUsage;
+        chartMounts.update();
+    } else {
+        const mountOpts = barOptions(commonOptions);
+        mountOpts.scales.x.max = 100;
+        chartMounts = new Chart(document.getElementById('nodeMountsChart').getContext('2d'), {
+            type: 'bar',
+            data: {
+                labels: mountNames,
+                datasets: [{
+                    label: `${lblDisk} (%)`,
+                    data: mountUsage,
+                    backgroundColor: '#a855f7'
+                }]
+            },
+            options: mountOpts
+        });
+    }
+}
+
+function barOptions(commonOptions) {
+    // horizontal bars: values on x, device names on y
+    const opts = JSON.parse(JSON.stringify(commonOptions));
+    opts.indexAxis = 'y';
+    opts.interaction.mode = 'nearest';
+    opts.scales.x.beginAtZero = true;
+    opts.scales.x.ticks.display = true;
+    opts.scales.y.beginAtZero = false;
+    return opts;
 }
 
 window.resetTrafficDashboard = async function() {
@@ -556,7 +556,7 @@ install_node_logic() {
     setup_repo_and_dirs "root"
     if [ ! -d "${VENV_PATH}" ]; then run_with_spinner "Creating venv" ${PYTHON_BIN} -m venv "${VENV_PATH}"; fi
     run_with_spinner "Updating pip" "${VENV_PATH}/bin/pip" install --upgrade pip
-    run_with_spinner "Installing dependencies" "${VENV_PATH}/bin/pip" install psutil requests
+    run_with_spinner "Installing dependencies" "${VENV_PATH}/bin/pip" install psutil requests msgpack websocket-client aiohttp
     load_cached_env
     msg_question "Agent URL (http://IP:8080): " AGENT_URL
     msg_question "Token: " NODE_TOKEN
@@ -0,0 +1,163 @@
+"""External IPv4 discovery shared by the agent (core/server.py) and the
+node (node/node.py). Lives at the top level because agent installs drop
+node/ and node installs drop core/. Standard library only; psutil is used
+for the interface heuristic when installed.
+
+Local heuristics run first and, when one of them finds a public address,
+no network request is made. Otherwise every HTTP service is queried at
+once and the first valid answer wins. The result is cached for a TTL and
+refreshed in a background thread, so callers never wait on the network
+after the first lookup.
+"""
+import ipaddress
+import logging
+import socket
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError, as_completed
+
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+
+IP_SERVICES = (
+    "https://api.ipify.org",
+    "https://ifconfig.me/ip",
+    "https://icanhazip.com",
+    "https://ipecho.net/plain",
+    "http://checkip.amazonaws.com",
+)
+# static: the configured address; interfaces: a public IPv4 bound to a
+# local interface; route: the source address the kernel picks for an
+# outbound route (a UDP connect sends no packets).
+HEURISTICS = ("static", "interfaces", "route")
+DEFAULT_TTL = 3600
+DEFAULT_TIMEOUT = 5
+
+
+def parse_heuristics(value: str) -> tuple:
+    names = [name.strip().lower() for name in (value or "").split(",")]
+    return tuple(name for name in names if name in HEURISTICS)
+
+
+def public_ipv4(value) -> str:
+    """The address as a string if it is a global IPv4, else None."""
+    try:
+        ip = ipaddress.IPv4Address(str(value).strip())
+    except ValueError:
+        return None
+    return str(ip) if ip.is_global else None
+
+
+class ExternalIPResolver:
+    def __init__(
+        self,
+        services=IP_SERVICES,
+        heuristics=HEURISTICS,
+        static_ip: str = None,
+        ttl: int = DEFAULT_TTL,
+        timeout: float = DEFAULT_TIMEOUT,
+    ):
+        self.services = tuple(services)
+        self.heuristics = tuple(heuristics)
+        self.static_ip = static_ip
+        self.ttl = ttl
+        self.timeout = timeout
+        self.ip = None
+        self.source = None
+        self.expires = 0
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def get(self):
+        """Cached address (None until the first lookup finishes). Starts a
+        background refresh when the cache is stale; never blocks."""
+        if time.time() >= self.expires:
+            self.refresh_in_background()
+        return self.ip
+
+    def refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self.resolve, name="ip-resolver", daemon=True).start()
+
+    def resolve(self):
+        """Looks the address up now and caches it. Blocks for at most
+        timeout seconds; returns the address or None."""
+        try:
+            ip, source = self._from_heuristics()
+            if ip is None:
+                ip, source = self._from_services()
+            now = time.time()
+            if ip:
+                if ip != self.ip:
+                    logging.info(f"External IP updated ({source}): {ip}")
+                self.ip, self.source = ip, source
+                self.expires = now + self.ttl
+            else:
+                # keep the last known address and retry sooner
+                self.expires = now + min(self.ttl, 60)
+            return self.ip
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _from_heuristics(self):
+        for name in self.heuristics:
+            try:
+                ip = getattr(self, f"_heuristic_{name}")()
+            except Exception as e:
+                logging.debug(f"IP heuristic {name} failed: {e}")
+                ip = None
+            if ip:
+                return ip, name
+        return None, None
+
+    def _heuristic_static(self):
+        return public_ipv4(self.static_ip) if self.static_ip else None
+
+    def _heuristic_interfaces(self):
+        if not PSUTIL_AVAILABLE:
+            return None
+        for addresses in psutil.net_if_addrs().values():
+            for address in addresses:
+                if address.family == socket.AF_INET:
+                    ip = public_ipv4(address.address)
+                    if ip:
+                        return ip
+        return None
+
+    def _heuristic_route(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.connect(("8.8.8.8", 53))
+            return public_ipv4(sock.getsockname()[0])
+
+    def _fetch(self, url):
+        request = urllib.request.Request(url, headers={"User-Agent": "curl/8"})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return public_ipv4(response.read(64).decode(errors="ignore"))
+
+    def _from_services(self):
+        if not self.services:
+            return None, None
+        pool = ThreadPoolExecutor(max_workers=len(self.services))
+        futures = {pool.submit(self._fetch, url): url for url in self.services}
+        try:
+            for future in as_completed(futures, timeout=self.timeout + 1):
+                try:
+                    ip = future.result()
+                except Exception:
+                    continue
+                if ip:
+                    return ip, futures[future]
+        except FuturesTimeoutError:
+            pass
+        finally:
+            # do not wait for the slower services
+            pool.shutdown(wait=False, cancel_futures=True)
+        return None, None
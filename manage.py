@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import asyncio
+import json
 import argparse
 import sys
 import os
@@ -25,6 +26,7 @@ logging.basicConfig(format="%(message)s", level=logging.INFO)
 
 from tortoise import Tortoise
 from core import config, auth, models, utils
+from core import nodes_db
 from core.nodes_db import init_db
 
 
@@ -64,11 +66,82 @@ async def cmd_webpass(args):
 async def cmd_stats(args):
     await init_services()
     try:
-        node_count = await models.Node.all().count()
-        active = await models.Node.filter(status="active").count()
+        counts = await nodes_db.count_nodes_by_status()
         print(f"📊 Статистика:")
-        print(f"   Всего нод: {node_count}")
-        print(f"   Активных: {active}")
+        print(f"   Всего нод: {counts['total']}")
+        print(f"   Активных: {counts['online']}")
+    finally:
+        await close_services()
+
+
+async def cmd_bench(args):
+    from core import benchmark
+
+    # per-node INFO lines would drown the report on large fleets
+    logging.getLogger().setLevel(logging.WARNING)
+    reports = []
+    for nodes in args.nodes or [None]:
+        print(
+            f"⏱ Бенчмарк '{args.suite}' на временной БД (нод: {nodes or 'по умолчанию'})...",
+            file=sys.stderr,
+        )
+        reports.append(
+            await benchmark.run(args.suite, nodes=nodes, rounds=args.rounds)
+        )
+    print(json.dumps(reports[0] if len(reports) == 1 else reports, indent=2))
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        baselines = baseline if isinstance(baseline, list) else [baseline]
+        regressions = []
+        for report in reports:
+            for old in baselines:
+                if old.get("suite") == report["suite"] and old.get("nodes") == report.get("nodes"):
+                    regressions += benchmark.compare(report, old)
+        for line in regressions:
+            print(f"❌ Регрессия: {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+async def cmd_simulate(args):
+    from core import simulator
+
+    logging.getLogger().setLevel(logging.WARNING)
+    url = args.url or f"http://127.0.0.1:{config.WEB_SERVER_PORT}"
+    await init_services()
+    try:
+        if args.cleanup:
+            removed = await simulator.remove_nodes()
+            print(f"🧹 Удалено виртуальных нод: {removed}")
+            return
+        tokens, created = await simulator.prepare_nodes(args.nodes)
+        if created and not args.no_wait:
+            # the running server drops its node caches on its next flush
+            # once it sees another process changed nodes.db
+            wait = 2 * config.NODES_DB_FLUSH_INTERVAL
+            print(f"⏳ Создано нод: {created}, ждём {wait:g} с...", file=sys.stderr)
+            await asyncio.sleep(wait)
+        print(
+            f"🚀 {len(tokens)} виртуальных нод -> {url}/api/heartbeat на {args.duration} с",
+            file=sys.stderr,
+        )
+        report = await simulator.run(
+            f"{url.rstrip('/')}/api/heartbeat",
+            tokens,
+            args.duration,
+            interval=args.interval,
+            task_interval=args.task_interval,
+            ssh_rate=args.ssh_rate,
+            obey_hints=not args.fixed_interval,
+        )
+        print(json.dumps(report, indent=2))
+        if "429" in report["statuses"]:
+            print(
+                "ℹ️  429: все виртуальные ноды идут с одного IP. Для теста поднимите "
+                "HEARTBEAT_IP_RATE / HEARTBEAT_IP_BURST в .env агента.",
+                file=sys.stderr,
+            )
     finally:
         await close_services()
 
@@ -145,6 +218,40 @@ def main():
     # Команда: stats
     subparsers.add_parser("stats", help="Показать статистику БД")
 
+    # Команда: bench
+    p_bench = subparsers.add_parser("bench", help="Бенчмарк хранилища нод (JSON)")
+    p_bench.add_argument(
+        "--suite", default="writes", help="Набор тестов: writes, storage, ingest"
+    )
+    p_bench.add_argument(
+        "--nodes", type=int, nargs="+", help="Количество нод (можно несколько: 1000 10000)"
+    )
+    p_bench.add_argument("--rounds", type=int, help="Количество циклов")
+    p_bench.add_argument(
+        "--baseline", help="JSON прошлого запуска: выход с кодом 1 при регрессии >20%%"
+    )
+
+    # Команда: simulate
+    p_sim = subparsers.add_parser(
+        "simulate", help="Нагрузочный тест: N виртуальных нод шлют heartbeat (JSON)"
+    )
+    p_sim.add_argument("--url", help="Адрес агента (по умолчанию http://127.0.0.1:WEB_SERVER_PORT)")
+    p_sim.add_argument("--nodes", type=int, default=100, help="Количество виртуальных нод")
+    p_sim.add_argument("--duration", type=float, default=60, help="Длительность, сек")
+    p_sim.add_argument("--interval", type=float, default=5, help="Интервал heartbeat, сек")
+    p_sim.add_argument(
+        "--fixed-interval", action="store_true", help="Игнорировать next_interval_ms сервера"
+    )
+    p_sim.add_argument(
+        "--task-interval", type=float, default=1, help="Отправлять задачу раз в N сек (0 - нет)"
+    )
+    p_sim.add_argument(
+        "--ssh-rate", type=float, default=0,
+        help="Доля heartbeat с SSH-входом (алерты уйдут админам в Telegram!)",
+    )
+    p_sim.add_argument("--no-wait", action="store_true", help="Не ждать, пока сервер увидит новые ноды")
+    p_sim.add_argument("--cleanup", action="store_true", help="Удалить виртуальные ноды sim-* и выйти")
+
     # Команда: cleanlogs
     subparsers.add_parser("cleanlogs", help="Очистить файлы логов")
 
@@ -164,6 +271,10 @@ def main():
             asyncio.run(cmd_webpass(args))
         elif args.command == "stats":
             asyncio.run(cmd_stats(args))
+        elif args.command == "bench":
+            asyncio.run(cmd_bench(args))
+        elif args.command == "simulate":
+            asyncio.run(cmd_simulate(args))
         elif args.command == "cleanlogs":
             asyncio.run(cmd_cleanlogs(args))
         elif args.command == "restart":
@@ -42,6 +42,7 @@ def get_button() -> KeyboardButton:
 def register_handlers(dp: Dispatcher):
     dp.message(I18nFilter(BUTTON_KEY))(nodes_handler)
     dp.callback_query(F.data == "nodes_list_refresh")(cq_nodes_list_refresh)
+    dp.callback_query(F.data.startswith("nodes_list_view_"))(cq_nodes_list_refresh)
     dp.callback_query(F.data == "node_add_new")(cq_add_node_start)
     dp.message(StateFilter(AddNodeStates.waiting_for_name))(process_node_name)
     dp.callback_query(F.data == "node_delete_menu")(cq_node_delete_menu)
@@ -61,21 +62,28 @@ def start_background_tasks(bot: Bot) -> list[asyncio.Task]:
     return [task_monitor, task_traffic]
 
 
-async def _prepare_nodes_data():
-    result = {}
-    now = time.time()
-    nodes = await nodes_db.get_all_nodes()
-    for token, node in nodes.items():
-        last_seen = node.get("last_seen", 0)
-        is_restarting = node.get("is_restarting", False)
-        if is_restarting:
-            icon = "🔵"
-        elif now - last_seen < config.NODE_OFFLINE_TIMEOUT:
-            icon = "🟢"
-        else:
-            icon = "🔴"
-        result[token] = {"name": node.get("name", "Unknown"), "status_icon": icon}
-    return result
+# Node menu views: filter/sort pushed down to nodes_db, at most
+# NODES_MENU_LIMIT buttons per view.
+NODES_MENU_LIMIT = 50
+NODES_MENU_VIEWS = {
+    "all": {},
+    "online": {"status": "online"},
+    "offline": {"status": "offline"},
+    "cpu": {"sort": "-cpu"},
+}
+STATUS_ICONS = {"online": "🟢", "offline": "🔴", "restarting": "🔵"}
+
+
+async def _prepare_nodes_data(view: str = "all"):
+    params = NODES_MENU_VIEWS.get(view, {})
+    nodes = await nodes_db.get_nodes_summary(limit=NODES_MENU_LIMIT, **params)
+    return {
+        token: {
+            "name": node.get("name", "Unknown"),
+            "status_icon": STATUS_ICONS.get(node["status"], "❓"),
+        }
+        for token, node in nodes.items()
+    }
 
 
 async def nodes_handler(message: types.Message):
@@ -97,8 +105,11 @@ async def nodes_handler(message: types.Message):
 async def cq_nodes_list_refresh(callback: types.CallbackQuery):
     user_id = callback.from_user.id
     lang = get_user_lang(user_id)
-    prepared_nodes = await _prepare_nodes_data()
-    keyboard = get_nodes_list_keyboard(prepared_nodes, lang)
+    view = "all"
+    if callback.data.startswith("nodes_list_view_"):
+        view = callback.data[len("nodes_list_view_"):]
+    prepared_nodes = await _prepare_nodes_data(view)
+    keyboard = get_nodes_list_keyboard(prepared_nodes, lang, view)
     try:
         await callback.message.edit_text(
             _("nodes_menu_header", lang), reply_markup=keyboard, parse_mode="HTML"
@@ -413,7 +424,9 @@ async def node_traffic_scheduler(bot: Bot):
                         del NODE_TRAFFIC_MONITORS[user_id]
                     continue
                 await nodes_db.update_node_task(
-                    token, {"command": "traffic", "user_id": user_id}
+                    token,
+                    {"command": "traffic", "user_id": user_id},
+                    ttl=config.TRAFFIC_INTERVAL * 2,
                 )
         except Exception as e:
             logging.error(f"Error in node_traffic_scheduler: {e}")
@@ -426,7 +439,7 @@ async def nodes_monitor(bot: Bot):
     while True:
         try:
             now = time.time()
-            nodes = await nodes_db.get_all_nodes()
+            nodes = await nodes_db.get_nodes_summary()
             for token, node in nodes.items():
                 name = html.escape(node.get("name", "Unknown"))
                 last_seen = node.get("last_seen", 0)
@@ -473,7 +486,6 @@ async def nodes_monitor(bot: Bot):
                 if not is_dead and is_restarting:
                     await nodes_db.update_node_extra(token, "is_restarting", False)
                 if not is_dead and last_seen > 0:
-                    stats = node.get("stats", {})
 
                     async def check(metric, current, threshold, key_high, key_norm):
                         state = alerts.get(metric, {"active": False, "last_time": 0})
@@ -484,7 +496,10 @@ async def nodes_monitor(bot: Bot):
                                 or now - state["last_time"]
                                 > config.RESOURCE_ALERT_COOLDOWN
                             ):
-                                p_info = stats.get(f"process_{metric}", "n/a")
+                                full = await nodes_db.get_node_by_token(token) or {}
+                                p_info = full.get("stats", {}).get(
+                                    f"process_{metric}", "n/a"
+                                )
                                 await send_alert(
                                     bot,
                                     lambda lang: _(
@@ -519,21 +534,21 @@ async def nodes_monitor(bot: Bot):
 
                     u1 = await check(
                         "cpu",
-                        stats.get("cpu", 0),
+                        node.get("cpu", 0),
                         config.CPU_THRESHOLD,
                         "alert_node_cpu_high",
                         "alert_node_cpu_normal",
                     )
                     u2 = await check(
                         "ram",
-                        stats.get("ram", 0),
+                        node.get("ram", 0),
                         config.RAM_THRESHOLD,
                         "alert_node_ram_high",
                         "alert_node_ram_normal",
                     )
                     u3 = await check(
                         "disk",
-                        stats.get("disk", 0),
+                        node.get("disk", 0),
                         config.DISK_THRESHOLD,
                         "alert_node_disk_high",
                         "alert_node_disk_normal",
@@ -162,7 +162,7 @@ async def cq_notif_menu_global(callback: types.CallbackQuery):
 async def cq_notif_menu_nodes_list(callback: types.CallbackQuery):
     user_id = callback.from_user.id
     lang = get_user_lang(user_id)
-    nodes = await nodes_db.get_all_nodes()
+    nodes = await nodes_db.get_nodes_summary()
     await callback.message.edit_text(
         _("notif_nodes_list_title", lang),
         reply_markup=get_notifications_nodes_list_keyboard(nodes, lang),
@@ -233,7 +233,7 @@ async def cq_toggle_all_nodes(callback: types.CallbackQuery):
     all_enabled_globally = all(user_conf.get(k, False) for k in node_keys)
     new_state = not all_enabled_globally
     
-    nodes = await nodes_db.get_all_nodes()
+    nodes = await nodes_db.get_nodes_summary()
     
     for k in node_keys:
         user_conf[k] = new_state
@@ -299,7 +299,7 @@ async def sync_node_global_state(user_id: int, alert_type: str):
     Checks if ALL nodes have the same state for a specific alert type.
     If so, updates the global setting and removes overrides.
     """
-    nodes = await nodes_db.get_all_nodes()
+    nodes = await nodes_db.get_nodes_summary()
     if not nodes:
         return
 
@@ -1,4 +1,5 @@
 import time
+import asyncio
 import psutil
 import requests
 import logging
@@ -10,11 +11,42 @@ import re
 import hmac
 import hashlib
 import json
+import sqlite3
+import array
 import collections
+import ctypes
+import ctypes.util
+import select
+import heapq
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+import zlib
 from datetime import datetime
 
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
+try:
+    import websocket
+    WS_AVAILABLE = True
+except ImportError:
+    WS_AVAILABLE = False
+
+try:
+    import aiohttp
+    AIOHTTP_AVAILABLE = True
+except ImportError:
+    AIOHTTP_AVAILABLE = False
+
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 ENV_FILE = os.path.join(BASE_DIR, '.env')
+# ip_resolver.py sits next to node/ and is shared with the agent
+sys.path.append(BASE_DIR)
+import ip_resolver
 
 def load_config():
     config = {}
@@ -78,18 +110,170 @@ if not AGENT_BASE_URL or not AGENT_TOKEN:
     sys.exit(1)
 
 PENDING_RESULTS = collections.deque(maxlen=50)
+# Task ids received from the server; acknowledged on the next heartbeat
+# so the server stops redelivering them.
+PENDING_ACKS = collections.deque(maxlen=200)
+SEEN_TASK_IDS = collections.deque(maxlen=200)
 LAST_TRAFFIC_STATS = {}
+# Delta heartbeats: after a full snapshot only changed stats are sent,
+# numbered by HEARTBEAT_SEQ. Any failed or rejected heartbeat, or a
+# server that does not advertise the delta protocol, means a full snapshot.
+HEARTBEAT_PROTO = 2
+HEARTBEAT_SEQ = 0
+LAST_SENT_STATS = None
+# Servers from protocol 3 take heartbeats without stats; the async agent
+# sends those when it has no new sample, so nothing is stored twice.
+STATSLESS_PROTO = 3
+SERVER_PROTO = 1
+# Body format and Content-Encoding, picked from what the server advertises
+# in its heartbeat replies. The first heartbeat is always plain JSON.
+SERVER_FORMATS = []
+SERVER_ENCODINGS = []
+COMPRESS_MIN_BYTES = 256
+# Server hint for the next heartbeat (next_interval_ms); None means use
+# UPDATE_INTERVAL with a little jitter.
+NEXT_INTERVAL_MS = None
+MIN_INTERVAL = 1
+MAX_INTERVAL = 60
+# WebSocket path advertised by the server ("ws" in heartbeat replies).
+NODE_WS_ENABLED = CONF.get("NODE_WS", "true").lower() == "true"
+SERVER_WS_PATH = None
+WS_RETRY_INTERVAL = 60
+# asyncio mode: one keep-alive aiohttp session, sampling, SSH monitor,
+# commands and heartbeats as separate tasks. Needs aiohttp.
+NODE_ASYNC = CONF.get("NODE_ASYNC", "true").lower() == "true"
 SSH_EVENTS = collections.deque(maxlen=100)
+# Set from worker threads (SSH logins, command results) to send the next
+# heartbeat right away instead of waiting out the interval.
+SEND_NOW = threading.Event()
+SSH_LOGIN_RE = re.compile(r"Accepted\s+(password|publickey)\s+for\s+(\S+)\s+from\s+(\S+)")
+SSH_SEEN_LINES = 1000
+SSH_POLL_INTERVAL = 0.5
+SSH_WAKE_INTERVAL = 5
+# Commands run on a small thread pool so heartbeats keep their cadence.
+# Budgets are per command; past it the requester gets a timeout error.
+COMMAND_WORKERS = int(CONF.get("NODE_COMMAND_WORKERS", 2))
+COMMAND_TIMEOUTS = {
+    "uptime": 10,
+    "traffic": 10,
+    "top": 15,
+    "selftest": 30,
+    # server list (requests, 5 s connect + 5 s read) and two iperf3 runs
+    # of up to 20 s each, or the list plus a 15 s ping fallback
+    "speedtest": 90,
+    "reboot": 30,
+}
+DEFAULT_COMMAND_TIMEOUT = 30
+# How long reboot waits for its confirmation to reach the agent.
+REBOOT_RESULT_WAIT = 10
+COMMAND_PROGRESS_AFTER = 5
+COMMAND_PROGRESS_EVERY = 30
+
+# Stats sampled while the agent is unreachable go to a small on-disk ring
+# (SQLite, at most SPOOL_MAX_ROWS samples) and are sent back in batches
+# to the backfill path the server advertises once it answers again.
+SPOOL_PATH = CONF.get("NODE_SPOOL_PATH", os.path.join(BASE_DIR, "node", "spool.db"))
+SPOOL_MAX_ROWS = int(CONF.get("NODE_SPOOL_MAX", 20000))
+BACKFILL_BATCH = 100
+BACKFILL_BATCH_SIZE = BACKFILL_BATCH
+BACKFILL_REFUSED_ID = 0
+SERVER_BACKFILL_PATH = None
+
+# CPU, RAM, network and disk I/O are sampled every SUB_SAMPLE_INTERVAL
+# seconds into fixed-size rings. Each heartbeat carries min/max/mean/p95
+# per metric over the window since the previous one (stats["agg"]), so
+# spikes shorter than the heartbeat interval still show up.
+SUB_SAMPLING_ENABLED = CONF.get("NODE_SUB_SAMPLING", "true").lower() == "true"
+SUB_SAMPLE_INTERVAL = 1
+SUB_SAMPLE_SLOTS = 128
+AGG_METRICS = ("cpu", "ram", "rx", "tx", "dr", "dw")
+
+# Per-NIC, per-mount, disk I/O and load metrics. Rates are taken between
+# two heartbeats; a new boot_time resets the baseline, and a counter that
+# went backwards (wrap, NIC reset) counts as zero for that interval.
+IO_MAX_NICS = 16
+IO_MAX_MOUNTS = 16
+IO_SKIP_FSTYPES = ("squashfs", "tmpfs", "devtmpfs", "overlay")
+LAST_IO_COUNTERS = None
+
+# Top processes need a walk over every process: done once per
+# PROCESS_SAMPLE_INTERVAL and cached, or on every heartbeat while the
+# server asks for live lists (someone watches the node, or it alerts).
+PROCESS_SAMPLE_INTERVAL = int(CONF.get("NODE_PROCESS_INTERVAL", 30))
+TOP_PROCESSES_COUNT = 3
+LIVE_PROCESSES = False
+TOP_PROCESSES_CACHE = {"time": 0, "cpu": "", "ram": ""}
+
+IP_RESOLVER = ip_resolver.ExternalIPResolver(
+    heuristics=ip_resolver.parse_heuristics(CONF.get("EXTERNAL_IP_HEURISTICS", "static,interfaces,route")),
+    static_ip=CONF.get("EXTERNAL_IP"),
+    ttl=int(CONF.get("EXTERNAL_IP_TTL", ip_resolver.DEFAULT_TTL)),
+)
+
+class Inotify:
+    """Just enough of inotify(7) over ctypes to sleep until a watched path
+    changes. Raises OSError where inotify is unavailable."""
+
+    IN_MODIFY = 0x002
+    IN_ATTRIB = 0x004
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_DELETE_SELF = 0x400
+    IN_MOVE_SELF = 0x800
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add_watch(self, path, mask):
+        wd = self._add_watch(self.fd, path.encode(), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {path}")
+        return wd
+
+    def rm_watch(self, wd):
+        self._rm_watch(self.fd, wd)
+
+    def wait(self, timeout):
+        """Blocks until an event or timeout; returns True on events. The
+        events themselves are drained and discarded."""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+        try:
+            while os.read(self.fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        return True
 
-EXTERNAL_IP_CACHE = None 
 
 class SSHMonitor:
+    """Tails auth.log/secure for accepted SSH logins. A watcher thread
+    sleeps on inotify (log file and its directory, for rotation) and falls
+    back to polling os.stat every SSH_POLL_INTERVAL seconds."""
+
     def __init__(self):
         self.log_files = ["/var/log/auth.log", "/var/log/secure"]
         self.current_file = None
         self.file_handle = None
         self.inode = None
-        self.processed_lines = collections.deque(maxlen=100)
+        # hashes of recent lines; the deque bounds the set in insertion order
+        self.seen = set()
+        self.seen_order = collections.deque()
+        self.inotify = None
+        self.file_wd = None
+        self.dir_wd = None
+        try:
+            self.inotify = Inotify()
+        except (OSError, AttributeError) as e:
+            logging.info(f"inotify unavailable ({e}), SSH log is polled.")
         self._open_log_file()
         if self.file_handle:
             self.file_handle.seek(0, 2)
@@ -103,12 +287,62 @@ class SSHMonitor:
                     self.file_handle = f
                     st = os.fstat(f.fileno())
                     self.inode = st.st_ino
+                    self._watch(log_path)
                     logging.info(f"SSH Monitor watching: {log_path}")
                     return
                 except Exception as e:
                     logging.error(f"Error opening SSH log {log_path}: {e}")
         logging.warning("No SSH log files found (auth.log/secure).")
 
+    def _watch(self, log_path):
+        if not self.inotify:
+            return
+        try:
+            if self.file_wd is not None:
+                self.inotify.rm_watch(self.file_wd)
+            self.file_wd = self.inotify.add_watch(
+                log_path, Inotify.IN_MODIFY | Inotify.IN_ATTRIB | Inotify.IN_MOVE_SELF | Inotify.IN_DELETE_SELF
+            )
+            if self.dir_wd is None:
+                self.dir_wd = self.inotify.add_watch(
+                    os.path.dirname(log_path), Inotify.IN_CREATE | Inotify.IN_MOVED_TO
+                )
+        except OSError as e:
+            logging.warning(f"inotify watch failed ({e}), SSH log is polled.")
+            self.inotify = None
+
+    def wait(self, timeout):
+        """Sleeps until the log may have new lines, at most timeout seconds."""
+        if self.inotify and self.file_wd is not None:
+            self.inotify.wait(timeout)
+            return
+        if not self.current_file:
+            time.sleep(timeout)
+            return
+        deadline = time.time() + timeout
+        try:
+            before = os.stat(self.current_file)
+        except OSError:
+            before = None
+        while time.time() < deadline:
+            time.sleep(SSH_POLL_INTERVAL)
+            try:
+                st = os.stat(self.current_file)
+            except OSError:
+                st = None
+            if before is None or st is None or (st.st_ino, st.st_size, st.st_mtime) != (before.st_ino, before.st_size, before.st_mtime):
+                return
+
+    def _is_new(self, line):
+        key = hash(line)
+        if key in self.seen:
+            return False
+        self.seen.add(key)
+        self.seen_order.append(key)
+        if len(self.seen_order) > SSH_SEEN_LINES:
+            self.seen.discard(self.seen_order.popleft())
+        return True
+
     def check(self):
         if not self.file_handle:
             return []
@@ -134,79 +368,53 @@ class SSHMonitor:
                 line = self.file_handle.readline()
                 if not line:
                     break
-                
-                if line in self.processed_lines:
+
+                if "Accepted" not in line or "ssh" not in line or not self._is_new(line):
                     continue
-                self.processed_lines.append(line)
-                if "Accepted" in line and "ssh" in line:
-                    match = re.search(r"Accepted\s+(password|publickey)\s+for\s+(\S+)\s+from\s+(\S+)", line)
-                    if match:
-                        method = match.group(1)
-                        user = match.group(2)
-                        ip = match.group(3)
-                        
-                        try:
-                            tz_offset = time.strftime('%z')
-                            tz_label = f"GMT{tz_offset[:3]}:{tz_offset[3:]}" if tz_offset else "GMT"
-                        except:
-                            tz_label = "GMT"
-
-                        events.append({
-                            "user": user,
-                            "ip": ip,
-                            "method": method,
-                            "timestamp": int(time.time()),
-                            "node_time_str": time.strftime('%H:%M:%S'),
-                            "tz_label": tz_label
-                        })
+                match = SSH_LOGIN_RE.search(line)
+                if match:
+                    method, user, ip = match.groups()
+
+                    try:
+                        tz_offset = time.strftime('%z')
+                        tz_label = f"GMT{tz_offset[:3]}:{tz_offset[3:]}" if tz_offset else "GMT"
+                    except:
+                        tz_label = "GMT"
+
+                    events.append({
+                        "user": user,
+                        "ip": ip,
+                        "method": method,
+                        "timestamp": int(time.time()),
+                        "node_time_str": time.strftime('%H:%M:%S'),
+                        "tz_label": tz_label
+                    })
         except Exception as e:
             logging.error(f"Error parsing SSH log: {e}")
         
         return events
 
-def get_external_ip():
-    global EXTERNAL_IP_CACHE
-    if EXTERNAL_IP_CACHE:
-        return EXTERNAL_IP_CACHE
-
-    services = [
-        "https://api.ipify.org",
-        "https://ifconfig.me/ip",
-        "https://icanhazip.com",
-        "https://ipecho.net/plain",
-        "http://checkip.amazonaws.com"
-    ]
-
-    for service in services:
-        try:
-            response = requests.get(service, timeout=5)
-            if response.status_code == 200:
-                ip = response.text.strip()
-                if re.match(r"^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$", ip):
-                    EXTERNAL_IP_CACHE = ip
-                    logging.info(f"External IP updated: {ip}")
-                    return ip
-        except Exception:
-            continue
-    
-    try:
-        # Security: Use exec instead of shell to prevent injection
-        proc = subprocess.Popen(
-            ["curl", "-4", "-s", "--max-time", "5", "ifconfig.me"],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-        stdout, _ = proc.communicate()
-        res = stdout.decode().strip()
-        if re.match(r"^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$", res):
-            EXTERNAL_IP_CACHE = res
-            logging.info(f"External IP updated (curl): {res}")
-            return res
-    except Exception as e:
-        logging.debug(f"Failed to get IP via curl: {e}")
+    def run(self, on_event):
+        while True:
+            try:
+                self.wait(SSH_WAKE_INTERVAL)
+                new_events = self.check()
+                if new_events:
+                    logging.info(f"Found {len(new_events)} SSH login events.")
+                    SSH_EVENTS.extend(new_events)
+                    on_event()
+            except Exception as e:
+                logging.error(f"SSH monitor error: {e}")
+                time.sleep(SSH_POLL_INTERVAL)
 
-    logging.warning("Could not determine external IP locally. Delegating to Agent Server.")
-    return None
+    def start(self, on_event):
+        threading.Thread(target=self.run, args=(on_event,), name="ssh-monitor", daemon=True).start()
+
+def get_external_ip():
+    """Cached external IP; refreshed in the background once its TTL is
+    over. None until the first lookup finishes, and the server then uses
+    the connection's address."""
+    return IP_RESOLVER.get()
 
 def format_uptime_simple(seconds):
     seconds = int(seconds)
@@ -241,32 +449,193 @@ def parse_iperf_speed(output: str, direction: str) -> float:
         
     return 0.0
 
-def get_top_processes(metric):
+def sample_top_processes(count=TOP_PROCESSES_COUNT):
+    """Top CPU and RAM lists from a single process_iter walk, each kept in
+    a bounded min-heap instead of sorting every process."""
     try:
-        attrs = ['pid', 'name', 'cpu_percent', 'memory_percent']
-        procs = []
-        for p in psutil.process_iter(attrs):
+        top_cpu, top_ram = [], []
+        for i, p in enumerate(psutil.process_iter(['name', 'cpu_percent', 'memory_percent'])):
+            name = (p.info['name'] or '?')[:15]
+            for heap, value in ((top_cpu, p.info['cpu_percent']), (top_ram, p.info['memory_percent'])):
+                item = (value or 0.0, i, name)
+                if len(heap) < count:
+                    heapq.heappush(heap, item)
+                elif item > heap[0]:
+                    heapq.heapreplace(heap, item)
+        return {
+            "cpu": ", ".join(f"{name} ({value}%)" for value, _, name in sorted(top_cpu, reverse=True)),
+            "ram": ", ".join(f"{name} ({value:.1f}%)" for value, _, name in sorted(top_ram, reverse=True)),
+        }
+    except Exception as e:
+        logging.error(f"Error getting top processes: {e}")
+        return {"cpu": "n/a", "ram": "n/a"}
+
+def get_top_processes():
+    now = time.time()
+    if LIVE_PROCESSES or now - TOP_PROCESSES_CACHE["time"] >= PROCESS_SAMPLE_INTERVAL:
+        TOP_PROCESSES_CACHE.update(sample_top_processes(), time=now)
+    return TOP_PROCESSES_CACHE
+
+class SubSampler:
+    """Background 1 s sampler. Every metric has a ring of SUB_SAMPLE_SLOTS
+    doubles; aggregate() reads the current window and starts a new one.
+    Network and disk values are byte rates between two samples."""
+
+    def __init__(self, slots=SUB_SAMPLE_SLOTS):
+        self.slots = slots
+        self.rings = {metric: array.array("d", bytes(8 * slots)) for metric in AGG_METRICS}
+        self.pos = 0
+        self.count = 0
+        self.last = None
+        self.latest_cpu = 0.0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def running(self):
+        return self.thread is not None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="sub-sampler", daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        while True:
             try:
-                p.info['name'] = p.info['name'][:15]
-                procs.append(p.info)
-            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-                pass
+                self.sample()
+            except Exception as e:
+                logging.error(f"Sub-sampling failed: {e}")
+            time.sleep(SUB_SAMPLE_INTERVAL)
 
-        if metric == 'cpu':
-            sorted_procs = sorted(procs, key=lambda p: p['cpu_percent'], reverse=True)[:3]
-            info_list = [f"{p['name']} ({p['cpu_percent']}%)" for p in sorted_procs]
-        elif metric == 'ram':
-            sorted_procs = sorted(procs, key=lambda p: p['memory_percent'], reverse=True)[:3]
-            info_list = [f"{p['name']} ({p['memory_percent']:.1f}%)" for p in sorted_procs]
-        else:
-            return ""
+    def sample(self):
+        now = time.time()
+        cpu = psutil.cpu_percent(interval=None)
+        net = psutil.net_io_counters()
+        disk = psutil.disk_io_counters()
+        last, self.last = self.last, (now, net, disk)
+        if last is None:
+            # the first cpu_percent() call has nothing to compare against
+            return
+        dt = max(now - last[0], 0.001)
 
-        return ", ".join(info_list)
-    except Exception as e:
-        logging.error(f"Error getting top processes: {e}")
-        return "n/a"
+        def rate(current, previous):
+            # counters go backwards on wrap or reset; count that step as 0
+            return max(current - previous, 0) / dt
+
+        values = {
+            "cpu": cpu,
+            "ram": psutil.virtual_memory().percent,
+            "rx": rate(net.bytes_recv, last[1].bytes_recv),
+            "tx": rate(net.bytes_sent, last[1].bytes_sent),
+            "dr": rate(disk.read_bytes, last[2].read_bytes) if disk and last[2] else 0.0,
+            "dw": rate(disk.write_bytes, last[2].write_bytes) if disk and last[2] else 0.0,
+        }
+        with self.lock:
+            for metric, value in values.items():
+                self.rings[metric][self.pos] = value
+            self.pos = (self.pos + 1) % self.slots
+            self.count = min(self.count + 1, self.slots)
+            self.latest_cpu = cpu
+
+    def aggregate(self):
+        """{metric: [min, max, mean, p95]} for the window since the last
+        call, or None if no sample was taken in it."""
+        with self.lock:
+            count = self.count
+            if not count:
+                return None
+            start = self.pos - count
+            windows = {
+                metric: sorted(ring[(start + i) % self.slots] for i in range(count))
+                for metric, ring in self.rings.items()
+            }
+            self.count = 0
+        p95 = max(0, -(-count * 95 // 100) - 1)
+        return {
+            metric: [
+                round(values[0], 2),
+                round(values[-1], 2),
+                round(sum(values) / count, 2),
+                round(values[p95], 2),
+            ]
+            for metric, values in windows.items()
+        }
+
+
+SUB_SAMPLER = SubSampler()
+
+
+def _rates(current, previous, dt):
+    return [round(max(c - p, 0) / dt, 1) for c, p in zip(current, previous)]
+
+
+def get_mount_usage():
+    usage = {}
+    for part in psutil.disk_partitions(all=False):
+        if part.fstype in IO_SKIP_FSTYPES or part.mountpoint in usage:
+            continue
+        try:
+            usage[part.mountpoint] = psutil.disk_usage(part.mountpoint).percent
+        except OSError:
+            continue
+        if len(usage) >= IO_MAX_MOUNTS:
+            break
+    return usage
+
+
+def get_io_metrics():
+    """load, mounts ({mountpoint: percent}), and once there is a baseline:
+    nics ({name: [rx B/s, tx B/s, rx pkt/s, tx pkt/s]}), net_rate (the
+    same summed over NICs) and disk_io ([read/s, write/s, read B/s,
+    write B/s])."""
+    global LAST_IO_COUNTERS
+    now = time.time()
+    boot = psutil.boot_time()
+    nics = {
+        name: (c.bytes_recv, c.bytes_sent, c.packets_recv, c.packets_sent)
+        for name, c in psutil.net_io_counters(pernic=True).items()
+        if name != "lo"
+    }
+    disk = psutil.disk_io_counters()
+    io = (disk.read_count, disk.write_count, disk.read_bytes, disk.write_bytes) if disk else None
+    last, LAST_IO_COUNTERS = LAST_IO_COUNTERS, {"time": now, "boot": boot, "nics": nics, "io": io}
+
+    metrics = {
+        "load": [round(value, 2) for value in os.getloadavg()],
+        "mounts": get_mount_usage(),
+    }
+    if last is None or abs(last["boot"] - boot) > 1 or now <= last["time"]:
+        return metrics
+    dt = now - last["time"]
+    nic_rates = {
+        name: _rates(counters, last["nics"][name], dt)
+        for name, counters in nics.items()
+        if name in last["nics"]
+    }
+    metrics["net_rate"] = [round(sum(rates[i] for rates in nic_rates.values()), 1) for i in range(4)]
+    metrics["nics"] = dict(sorted(nic_rates.items())[:IO_MAX_NICS])
+    if io and last["io"]:
+        metrics["disk_io"] = _rates(io, last["io"], dt)
+    return metrics
+
+
+def _sample_cpu_percent(interval=0.5):
+    """CPU usage over interval from two cpu_times() reads. Unlike
+    psutil.cpu_percent() it leaves the baseline of the heartbeat's and the
+    sub-sampler's calls alone."""
+    before = psutil.cpu_times()
+    time.sleep(interval)
+    after = psutil.cpu_times()
+    total = sum(after) - sum(before)
+    idle = (after.idle - before.idle) + (getattr(after, "iowait", 0) - getattr(before, "iowait", 0))
+    return round(100 * (1 - idle / total), 1) if total > 0 else 0.0
 
-def get_system_stats():
+
+def get_system_stats(consume=True):
+    """Stats for a heartbeat. consume=False gives a read-only snapshot for
+    commands: no window aggregate and no I/O rates, so the sub-sample
+    window and the I/O baseline stay with the next heartbeat."""
     try:
         net = psutil.net_io_counters()
         mem = psutil.virtual_memory()
@@ -274,9 +643,18 @@ def get_system_stats():
         freq = psutil.cpu_freq()
         
         ext_ip = get_external_ip()
-        
-        return {
-            "cpu": psutil.cpu_percent(interval=None),
+        top = get_top_processes()
+        agg = None
+        if not consume:
+            cpu = SUB_SAMPLER.latest_cpu if SUB_SAMPLER.running else _sample_cpu_percent()
+        elif SUB_SAMPLER.running:
+            agg = SUB_SAMPLER.aggregate()
+            cpu = agg["cpu"][2] if agg else SUB_SAMPLER.latest_cpu
+        else:
+            cpu = psutil.cpu_percent(interval=None)
+
+        stats = {
+            "cpu": cpu,
             "ram": mem.percent,
             "disk": disk.percent,
             "ram_total": mem.total,
@@ -287,10 +665,20 @@ def get_system_stats():
             "net_rx": net.bytes_recv,
             "net_tx": net.bytes_sent,
             "uptime": int(time.time() - psutil.boot_time()),
-            "process_cpu": get_top_processes('cpu'),
-            "process_ram": get_top_processes('ram'),
+            "process_cpu": top["cpu"],
+            "process_ram": top["ram"],
             "external_ip": ext_ip
         }
+        if agg:
+            stats["agg"] = agg
+        try:
+            if consume:
+                stats.update(get_io_metrics())
+            else:
+                stats.update(load=[round(value, 2) for value in os.getloadavg()], mounts=get_mount_usage())
+        except Exception as e:
+            logging.error(f"Error gathering I/O metrics: {e}")
+        return stats
     except Exception as e:
         logging.error(f"Error gathering stats: {e}")
         return {}
@@ -308,11 +696,16 @@ def get_public_iperf_server():
         logging.error(f"Error fetching iperf servers: {e}")
     return None
 
-def execute_command(task):
+def execute_command(task, deliver=None):
+    """Runs one command and hands its result to deliver(result_payload);
+    by default the result is queued for the requesting user."""
     global LAST_TRAFFIC_STATS
     cmd = task.get("command")
     user_id = task.get("user_id")
     logging.info(f"Executing command: {cmd}")
+    if deliver is None:
+        deliver = lambda payload: PENDING_RESULTS.append(
+            {"command": cmd, "user_id": user_id, "result": payload})
 
     result_payload = None
     try:
@@ -373,7 +766,7 @@ def execute_command(task):
                     stdout=subprocess.PIPE,
                     stderr=subprocess.PIPE
                 )
-                stdout, _ = proc.communicate()
+                stdout, _ = proc.communicate(timeout=10)
                 all_lines = stdout.decode().split('\n')
                 res = '\n'.join(all_lines[:11])  # Head -n 11
                 
@@ -395,7 +788,7 @@ def execute_command(task):
                 }
 
         elif cmd == "selftest":
-            stats = get_system_stats()
+            stats = get_system_stats(consume=False)
             try:
                 ext_ip = stats.get("external_ip")
                 if not ext_ip:
@@ -404,7 +797,7 @@ def execute_command(task):
                         stdout=subprocess.PIPE,
                         stderr=subprocess.PIPE
                     )
-                    stdout, _ = proc.communicate()
+                    stdout, _ = proc.communicate(timeout=10)
                     ext_ip = stdout.decode().strip()
             except Exception:
                 ext_ip = "N/A"
@@ -417,7 +810,7 @@ def execute_command(task):
                     stdout=subprocess.PIPE,
                     stderr=subprocess.PIPE
                 )
-                stdout, _ = proc.communicate()
+                stdout, _ = proc.communicate(timeout=10)
                 ping_res = stdout.decode()
                 ping_match = re.search(r"time=([\d\.]+) ms", ping_res)
                 if ping_match:
@@ -433,7 +826,7 @@ def execute_command(task):
                     stdout=subprocess.PIPE,
                     stderr=subprocess.PIPE
                 )
-                stdout, _ = proc.communicate()
+                stdout, _ = proc.communicate(timeout=10)
                 kernel = stdout.decode().strip()
             except Exception:
                 kernel = "N/A"
@@ -505,7 +898,7 @@ def execute_command(task):
                 }
             else:
                 try:
-                    res = subprocess.check_output("ping -c 3 8.8.8.8", shell=True).decode()
+                    res = subprocess.check_output("ping -c 3 8.8.8.8", shell=True, timeout=15).decode()
                     result_payload = {
                         "type": "i18n",
                         "key": "error_with_details",
@@ -524,9 +917,14 @@ def execute_command(task):
                 "key": "reboot_confirmed",
                 "params": {}
             }
-            PENDING_RESULTS.append(
-                {"command": cmd, "user_id": user_id, "result": result_payload})
-            send_heartbeat()
+            # the heartbeat loop sends the result (deliver wakes it up);
+            # give it a moment to get out before the host goes down
+            deliver(result_payload)
+            deadline = time.time() + REBOOT_RESULT_WAIT
+            while time.time() < deadline and any(
+                item["result"] is result_payload for item in list(PENDING_RESULTS)
+            ):
+                time.sleep(0.2)
             try:
                 subprocess.Popen(["reboot"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
             except Exception as e:
@@ -544,7 +942,7 @@ def execute_command(task):
         result_payload = {
             "type": "i18n",
             "key": "error_with_details",
-            "params": {"error": "Speedtest timed out."}
+            "params": {"error": f"{cmd} timed out."}
         }
     except Exception as e:
         logging.error(f"Command execution failed: {e}")
@@ -555,65 +953,645 @@ def execute_command(task):
         }
 
     if result_payload:
-        PENDING_RESULTS.append({
-            "command": cmd,
-            "user_id": user_id,
-            "result": result_payload
-        })
+        deliver(result_payload)
 
-def send_heartbeat():
-    global PENDING_RESULTS, SSH_EVENTS  # noqa: F824
-    url = f"{AGENT_BASE_URL}/api/heartbeat"
-    current_results = list(PENDING_RESULTS)
-    current_ssh_events = list(SSH_EVENTS)
-    
-    payload_dict = {
+
+class CommandExecutor:
+    """Bounded pool for node commands. A command that is already running is
+    not started again; later requesters get the same result. Past its
+    budget in COMMAND_TIMEOUTS the requesters get a timeout error and the
+    late result is dropped. Long commands report progress from poll()."""
+
+    def __init__(self, workers=COMMAND_WORKERS):
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="command")
+        self.lock = threading.Lock()
+        self.running = {}
+        # called from worker threads when a result is queued
+        self.on_result = None
+
+    def submit(self, task):
+        cmd = task.get("command")
+        user_id = task.get("user_id")
+        now = time.time()
+        with self.lock:
+            job = self.running.get(cmd)
+            if job is not None:
+                if user_id not in job["users"]:
+                    job["users"].append(user_id)
+                logging.info(f"Command {cmd} is already running, sharing its result.")
+                return
+            job = {
+                "users": [user_id],
+                "started": now,
+                "deadline": now + COMMAND_TIMEOUTS.get(cmd, DEFAULT_COMMAND_TIMEOUT),
+                "progress_at": now + COMMAND_PROGRESS_AFTER,
+            }
+            self.running[cmd] = job
+        future = self.pool.submit(execute_command, task, lambda payload: self._finish(cmd, job, payload))
+        future.add_done_callback(lambda _: self._finish(cmd, job, None))
+
+    def _queue_results(self, cmd, users, payload):
+        for user_id in users:
+            PENDING_RESULTS.append({"command": cmd, "user_id": user_id, "result": payload})
+
+    def _finish(self, cmd, job, payload):
+        with self.lock:
+            if self.running.get(cmd) is not job:
+                return
+            del self.running[cmd]
+            if payload is not None:
+                self._queue_results(cmd, job["users"], payload)
+        if payload is not None and self.on_result:
+            self.on_result()
+
+    def poll(self):
+        """Times out overdue commands and reports progress on long ones.
+        Returns True if anything was queued for the server."""
+        now = time.time()
+        queued = False
+        with self.lock:
+            for cmd, job in list(self.running.items()):
+                if now >= job["deadline"]:
+                    del self.running[cmd]
+                    logging.warning(f"Command {cmd} timed out.")
+                    self._queue_results(cmd, job["users"], {
+                        "type": "i18n",
+                        "key": "error_with_details",
+                        "params": {"error": f"{cmd} timed out after {int(now - job['started'])} s."}
+                    })
+                    queued = True
+                elif now >= job["progress_at"]:
+                    job["progress_at"] = now + COMMAND_PROGRESS_EVERY
+                    self._queue_results(cmd, job["users"], {
+                        "type": "i18n",
+                        "key": "node_cmd_running",
+                        "params": {"cmd": cmd, "elapsed": int(now - job["started"])}
+                    })
+                    queued = True
+        return queued
+
+
+COMMANDS = CommandExecutor()
+
+class MetricSpool:
+    """Bounded on-disk ring of (timestamp, stats) samples. The file is only
+    created once the first sample has to be kept."""
+
+    def __init__(self, path=SPOOL_PATH, max_rows=SPOOL_MAX_ROWS):
+        self.path = path
+        self.max_rows = max_rows
+        self.lock = threading.Lock()
+        self.db = None
+        self.has_data = os.path.exists(path)
+
+    def _conn(self):
+        if self.db is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.db = sqlite3.connect(self.path, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS spool "
+                "(id INTEGER PRIMARY KEY AUTOINCREMENT, ts REAL NOT NULL, stats TEXT NOT NULL)"
+            )
+        return self.db
+
+    def add(self, stats, ts):
+        if not stats:
+            return
+        try:
+            with self.lock:
+                db = self._conn()
+                with db:
+                    cur = db.execute("INSERT INTO spool (ts, stats) VALUES (?, ?)", (ts, json.dumps(stats)))
+                    db.execute("DELETE FROM spool WHERE id <= ?", (cur.lastrowid - self.max_rows,))
+                self.has_data = True
+        except Exception as e:
+            logging.error(f"Could not spool stats: {e}")
+
+    def peek(self, limit):
+        """Oldest samples as (last id, [[ts, stats], ...])."""
+        with self.lock:
+            rows = self._conn().execute(
+                "SELECT id, ts, stats FROM spool ORDER BY id LIMIT ?", (limit,)
+            ).fetchall()
+            if not rows:
+                self.has_data = False
+                return None, []
+            return rows[-1][0], [[ts, json.loads(stats)] for _, ts, stats in rows]
+
+    def remove(self, last_id):
+        with self.lock:
+            db = self._conn()
+            with db:
+                db.execute("DELETE FROM spool WHERE id <= ?", (last_id,))
+            self.has_data = db.execute("SELECT EXISTS (SELECT 1 FROM spool)").fetchone()[0] == 1
+
+
+SPOOL = MetricSpool()
+
+
+def build_backfill():
+    """Returns (url, body, headers, last id) for the next batch of spooled
+    samples, or None when there is nothing to send yet."""
+    if not SERVER_BACKFILL_PATH or not SPOOL.has_data:
+        return None
+    try:
+        last_id, samples = SPOOL.peek(BACKFILL_BATCH_SIZE)
+    except Exception as e:
+        logging.error(f"Could not read spooled stats: {e}")
+        return None
+    if not samples:
+        return None
+    body, headers = encode_heartbeat({
         "token": AGENT_TOKEN,
-        "stats": get_system_stats(),
-        "results": current_results,
-        "ssh_logins": current_ssh_events,
+        "samples": samples,
         "timestamp": int(time.time())
-    }
-    
-    payload_bytes = json.dumps(payload_dict, sort_keys=True).encode('utf-8')
-    
-    signature = hmac.new(AGENT_TOKEN.encode(), payload_bytes, hashlib.sha256).hexdigest()
-    
+    })
+    return f"{AGENT_BASE_URL}{SERVER_BACKFILL_PATH}", body, headers, (last_id, len(samples))
+
+
+def backfill_done(status, batch):
+    """A refused batch (400/413) is kept and retried in halves until the
+    refused range is through, so only a single sample the server will
+    never take is dropped."""
+    global BACKFILL_BATCH_SIZE, BACKFILL_REFUSED_ID
+    last_id, count = batch
+    if status in (400, 413) and count > 1:
+        BACKFILL_BATCH_SIZE = count // 2
+        BACKFILL_REFUSED_ID = max(BACKFILL_REFUSED_ID, last_id)
+        logging.warning(f"Server refused {count} spooled samples ({status}), retrying {BACKFILL_BATCH_SIZE} at a time.")
+        return
+    if status not in (200, 400, 413):
+        logging.warning(f"Backfill deferred, server returned status: {status}")
+        return
+    SPOOL.remove(last_id)
+    if last_id >= BACKFILL_REFUSED_ID:
+        BACKFILL_BATCH_SIZE = BACKFILL_BATCH
+    if status == 200:
+        logging.info(f"Backfilled {count} spooled samples.")
+    else:
+        logging.warning(f"Server refused a spooled sample ({status}), dropped.")
+
+
+def send_backfill():
+    request = build_backfill()
+    if request is None:
+        return
+    url, body, headers, batch = request
+    try:
+        response = requests.post(url, data=body, headers=headers, timeout=10)
+        backfill_done(response.status_code, batch)
+    except Exception as e:
+        logging.warning(f"Backfill failed: {e}")
+
+
+def _stats_delta(stats):
+    """Changed keys since the last acknowledged stats, or None when a full
+    snapshot must go out instead: a delta cannot express a removed key."""
+    if LAST_SENT_STATS is None or not stats or any(k not in stats for k in LAST_SENT_STATS):
+        return None
+    return {k: v for k, v in stats.items() if LAST_SENT_STATS.get(k) != v}
+
+
+def encode_heartbeat(payload_dict):
+    """Returns (body, headers). X-Signature covers the uncompressed body;
+    the server undoes Content-Encoding before checking it."""
+    if "msgpack" in SERVER_FORMATS and MSGPACK_AVAILABLE:
+        body = msgpack.packb(payload_dict, use_bin_type=True)
+        content_type = "application/msgpack"
+    else:
+        body = json.dumps(payload_dict, sort_keys=True).encode('utf-8')
+        content_type = "application/json"
+    signature = hmac.new(AGENT_TOKEN.encode(), body, hashlib.sha256).hexdigest()
     headers = {
-        "Content-Type": "application/json",
-        "X-Signature": signature
+        "Content-Type": content_type,
+        "X-Signature": signature,
+        "X-Node-Id": hashlib.sha256(AGENT_TOKEN.encode()).hexdigest(),
+        "X-Timestamp": str(payload_dict["timestamp"])
     }
+    if len(body) >= COMPRESS_MIN_BYTES:
+        if "gzip" in SERVER_ENCODINGS:
+            body = gzip.compress(body, compresslevel=6)
+            headers["Content-Encoding"] = "gzip"
+        elif "deflate" in SERVER_ENCODINGS:
+            body = zlib.compress(body, 6)
+            headers["Content-Encoding"] = "deflate"
+    return body, headers
+
+
+def sign_frame(payload_dict):
+    """WebSocket frame: the JSON payload as text plus its HMAC."""
+    text = json.dumps(payload_dict, sort_keys=True)
+    signature = hmac.new(AGENT_TOKEN.encode(), text.encode(), hashlib.sha256).hexdigest()
+    return json.dumps({"payload": text, "signature": signature})
+
+
+def build_heartbeat(stats=None, with_stats=True):
+    """Returns the heartbeat payload and what it carried, for the reply.
+    Samples stats unless the caller already has them; with_stats=False
+    sends only results, logins and acks (sent["stats"] is None)."""
+    global HEARTBEAT_SEQ
+    sent = {
+        "results": list(PENDING_RESULTS),
+        "ssh_logins": list(SSH_EVENTS),
+        "acks": list(PENDING_ACKS),
+        "stats": None,
+        "time": time.time(),
+    }
+    payload_dict = {
+        "token": AGENT_TOKEN,
+        "results": sent["results"],
+        "ssh_logins": sent["ssh_logins"],
+        "acks": sent["acks"],
+        "timestamp": int(time.time())
+    }
+    if not with_stats:
+        return payload_dict, sent
+    sent["stats"] = stats if stats is not None else get_system_stats()
+    HEARTBEAT_SEQ += 1
+    payload_dict["seq"] = HEARTBEAT_SEQ
+    delta = _stats_delta(sent["stats"])
+    if delta is None:
+        payload_dict["stats"] = sent["stats"]
+    else:
+        payload_dict["delta"] = delta
+    return payload_dict, sent
+
+
+def handle_heartbeat_reply(data, sent):
+    global LAST_SENT_STATS, SERVER_FORMATS, SERVER_ENCODINGS, NEXT_INTERVAL_MS, SERVER_WS_PATH, LIVE_PROCESSES
+    global SERVER_BACKFILL_PATH, SERVER_PROTO
+    SERVER_PROTO = data.get("proto", 1)
+    SERVER_FORMATS = data.get("formats", [])
+    SERVER_BACKFILL_PATH = data.get("backfill")
+    LIVE_PROCESSES = bool(data.get("live_processes"))
+    SERVER_ENCODINGS = data.get("encodings", [])
+    NEXT_INTERVAL_MS = data.get("next_interval_ms")
+    SERVER_WS_PATH = data.get("ws")
+    for item in sent["results"]:
+        if item in PENDING_RESULTS:
+            PENDING_RESULTS.remove(item)
+    for item in sent["ssh_logins"]:
+        if item in SSH_EVENTS:
+            SSH_EVENTS.remove(item)
+    for task_id in sent["acks"]:
+        if task_id in PENDING_ACKS:
+            PENDING_ACKS.remove(task_id)
+
+    if SERVER_PROTO < HEARTBEAT_PROTO or data.get("resync"):
+        if data.get("resync"):
+            logging.info("Server requested a full stats snapshot.")
+        LAST_SENT_STATS = None
+    elif sent["stats"] is not None:
+        LAST_SENT_STATS = sent["stats"]
+
+    handle_tasks(data.get("tasks", []))
+
+
+def handle_tasks(tasks):
+    for task in tasks:
+        task_id = task.get("id")
+        if task_id is not None:
+            # Ack on receipt: a reboot task must not come back after the reboot
+            PENDING_ACKS.append(task_id)
+            if task_id in SEEN_TASK_IDS:
+                continue
+            SEEN_TASK_IDS.append(task_id)
+        COMMANDS.submit(task)
+
+
+def heartbeat_failed():
+    global LAST_SENT_STATS, NEXT_INTERVAL_MS, SERVER_BACKFILL_PATH
+    LAST_SENT_STATS = None
+    NEXT_INTERVAL_MS = None
+    # backfill again only after a heartbeat gets through
+    SERVER_BACKFILL_PATH = None
+
+
+def heartbeat_unreachable(sent, reason):
+    heartbeat_failed()
+    # a sample resent to an older server is already in the spool
+    if sent["stats"] is not None and sent.get("fresh", True):
+        SPOOL.add(sent["stats"], sent["time"])
+    logging.error(f"Connection error: {reason}")
+
+
+def heartbeat_rejected(status, text):
+    global SERVER_FORMATS, SERVER_ENCODINGS
+    heartbeat_failed()
+    if status in (400, 415):
+        # Fall back to plain JSON if the server stopped accepting the format
+        SERVER_FORMATS, SERVER_ENCODINGS = [], []
+    logging.warning(f"Server returned status: {status} {text}")
+
+
+def send_heartbeat():
+    url = f"{AGENT_BASE_URL}/api/heartbeat"
+    payload_dict, sent = build_heartbeat()
+    payload_bytes, headers = encode_heartbeat(payload_dict)
 
     try:
         response = requests.post(url, data=payload_bytes, headers=headers, timeout=5)
         if response.status_code == 200:
-            data = response.json()
-            PENDING_RESULTS.clear()
-            SSH_EVENTS.clear()
-
-            tasks = data.get("tasks", [])
-            for task in tasks:
-                execute_command(task)
+            handle_heartbeat_reply(response.json(), sent)
+        elif response.status_code >= 500:
+            heartbeat_unreachable(sent, f"server returned status {response.status_code}")
         else:
-            logging.warning(f"Server returned status: {response.status_code} {response.text}")
+            heartbeat_rejected(response.status_code, response.text)
     except Exception as e:
-        logging.error(f"Connection error: {e}")
+        heartbeat_unreachable(sent, e)
+
+
+def next_sleep_interval():
+    if isinstance(NEXT_INTERVAL_MS, (int, float)) and NEXT_INTERVAL_MS > 0:
+        interval = NEXT_INTERVAL_MS / 1000
+    else:
+        interval = UPDATE_INTERVAL * random.uniform(0.9, 1.1)
+    return min(MAX_INTERVAL, max(MIN_INTERVAL, interval))
+
+
+class NodeChannel:
+    """Optional WebSocket to the agent (/api/node/ws). Heartbeats and
+    results go up as signed frames; the agent pushes tasks the moment they
+    are queued. Any error closes it and the node falls back to HTTP
+    heartbeats, retrying the socket every WS_RETRY_INTERVAL seconds."""
+
+    def __init__(self):
+        self.ws = None
+        self.next_attempt = 0
+        self.in_flight = None
+        self.send_soon = False
+
+    @property
+    def connected(self):
+        return self.ws is not None
+
+    def _send(self, payload_dict):
+        self.ws.send(sign_frame(payload_dict))
+
+    def connect(self, path):
+        if time.time() < self.next_attempt:
+            return
+        self.next_attempt = time.time() + WS_RETRY_INTERVAL
+        url = re.sub(r"^http", "ws", AGENT_BASE_URL.rstrip("/")) + path
+        try:
+            self.ws = websocket.create_connection(url, timeout=10)
+            self._send({"type": "hello", "token": AGENT_TOKEN, "timestamp": int(time.time())})
+            reply = json.loads(self.ws.recv())
+            if reply.get("type") != "welcome":
+                raise ValueError(f"unexpected reply: {reply}")
+            self.in_flight = None
+            logging.info("WebSocket channel to agent established.")
+        except Exception as e:
+            logging.warning(f"WebSocket channel unavailable, using HTTP heartbeats: {e}")
+            self.close()
+
+    def close(self):
+        if self.ws is not None:
+            try:
+                self.ws.close()
+            except Exception:
+                pass
+        self.ws = None
+        if self.in_flight is not None:
+            heartbeat_failed()
+        self.in_flight = None
+
+    def _send_heartbeat(self):
+        payload_dict, sent = build_heartbeat()
+        payload_dict["type"] = "heartbeat"
+        self._send(payload_dict)
+        self.in_flight = sent
+        self.send_soon = False
+
+    def run_cycle(self, interval):
+        """Sends a heartbeat, then handles pushed frames until the interval
+        is over. Returns False if the channel broke."""
+        deadline = time.time() + interval
+        try:
+            if self.in_flight is None:
+                self._send_heartbeat()
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return True
+                # short slices so SEND_NOW is noticed quickly
+                self.ws.settimeout(min(remaining, SSH_POLL_INTERVAL))
+                try:
+                    frame = json.loads(self.ws.recv())
+                except websocket.WebSocketTimeoutException:
+                    frame = {}
+                if frame.get("type") == "heartbeat":
+                    sent, self.in_flight = self.in_flight, None
+                    if sent is not None:
+                        handle_heartbeat_reply(frame, sent)
+                elif frame.get("type") == "tasks":
+                    handle_tasks(frame.get("tasks", []))
+                    self.send_soon = True
+                if SEND_NOW.is_set():
+                    SEND_NOW.clear()
+                    self.send_soon = True
+                if self.send_soon and self.in_flight is None:
+                    # stream results and acks back right away
+                    self._send_heartbeat()
+        except Exception as e:
+            logging.warning(f"WebSocket channel lost: {e}")
+            self.close()
+            return False
+
+
+class AsyncAgent:
+    """asyncio agent (NODE_ASYNC). Heartbeats reuse one keep-alive aiohttp
+    session, and the WebSocket channel, when the server offers it, rides on
+    the same session. Sampling, command polling and sending are separate
+    tasks; psutil sampling, commands and the SSH monitor run in threads so
+    a slow one never holds up a heartbeat."""
+
+    def __init__(self):
+        self.session = None
+        self.ws = None
+        self.ws_task = None
+        self.in_flight = None
+        self.in_flight_at = 0
+        self.next_ws_attempt = 0
+        self.stats = None
+        # True until self.stats went out in a heartbeat
+        self.stats_fresh = False
+        # set when a heartbeat is due: fresh stats, results, SSH logins or acks
+        self.wake = asyncio.Event()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        wake = lambda: loop.call_soon_threadsafe(self.wake.set)
+        COMMANDS.on_result = wake
+        SSHMonitor().start(wake)
+        connector = aiohttp.TCPConnector(limit=4, keepalive_timeout=75)
+        timeout = aiohttp.ClientTimeout(total=10)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            self.session = session
+            await asyncio.gather(
+                self.sample_loop(),
+                self.command_loop(),
+                self.heartbeat_loop(),
+            )
+
+    async def sample_loop(self):
+        while True:
+            self.stats = await asyncio.to_thread(get_system_stats)
+            self.stats_fresh = True
+            self.wake.set()
+            await asyncio.sleep(next_sleep_interval())
+
+    async def command_loop(self):
+        while True:
+            if COMMANDS.poll():
+                self.wake.set()
+            await asyncio.sleep(1)
+
+    async def heartbeat_loop(self):
+        while True:
+            await self.wake.wait()
+            self.wake.clear()
+            if self.stats is None:
+                continue
+            if self.ws is not None:
+                await self.ws_send_heartbeat()
+            else:
+                await self.post_heartbeat()
+                if NODE_WS_ENABLED and SERVER_WS_PATH:
+                    await self.ws_connect(SERVER_WS_PATH)
+            await self.send_backfill()
+
+    def build(self):
+        """A heartbeat with the latest sample if it has not gone out yet;
+        otherwise results/acks only (older servers get the sample again)."""
+        fresh, self.stats_fresh = self.stats_fresh, False
+        with_stats = fresh or SERVER_PROTO < STATSLESS_PROTO
+        payload_dict, sent = build_heartbeat(self.stats, with_stats)
+        sent["fresh"] = fresh
+        return payload_dict, sent
+
+    async def post_heartbeat(self):
+        payload_dict, sent = self.build()
+        body, headers = encode_heartbeat(payload_dict)
+        try:
+            async with self.session.post(
+                f"{AGENT_BASE_URL}/api/heartbeat", data=body, headers=headers
+            ) as response:
+                if response.status == 200:
+                    data = await response.json(content_type=None)
+                    handle_heartbeat_reply(data, sent)
+                elif response.status >= 500:
+                    heartbeat_unreachable(sent, f"server returned status {response.status}")
+                else:
+                    heartbeat_rejected(response.status, await response.text())
+        except Exception as e:
+            heartbeat_unreachable(sent, e)
+
+    async def send_backfill(self):
+        request = await asyncio.to_thread(build_backfill)
+        if request is None:
+            return
+        url, body, headers, batch = request
+        try:
+            async with self.session.post(url, data=body, headers=headers) as response:
+                status = response.status
+            await asyncio.to_thread(backfill_done, status, batch)
+        except Exception as e:
+            logging.warning(f"Backfill failed: {e}")
+
+    async def ws_connect(self, path):
+        if time.time() < self.next_ws_attempt:
+            return
+        self.next_ws_attempt = time.time() + WS_RETRY_INTERVAL
+        url = re.sub(r"^http", "ws", AGENT_BASE_URL.rstrip("/")) + path
+        ws = None
+        try:
+            ws = await self.session.ws_connect(url, heartbeat=30)
+            await ws.send_str(sign_frame({"type": "hello", "token": AGENT_TOKEN, "timestamp": int(time.time())}))
+            reply = await ws.receive_json(timeout=10)
+            if reply.get("type") != "welcome":
+                raise ValueError(f"unexpected reply: {reply}")
+        except Exception as e:
+            logging.warning(f"WebSocket channel unavailable, using HTTP heartbeats: {e}")
+            if ws is not None:
+                await ws.close()
+            return
+        self.ws = ws
+        self.in_flight = None
+        self.ws_task = asyncio.create_task(self.ws_reader(ws))
+        logging.info("WebSocket channel to agent established.")
+
+    async def ws_send_heartbeat(self):
+        if self.in_flight is not None:
+            # no reply for several intervals: drop to HTTP heartbeats
+            if time.time() - self.in_flight_at > 3 * next_sleep_interval():
+                await self.ws.close()
+            return
+        payload_dict, sent = self.build()
+        payload_dict["type"] = "heartbeat"
+        self.in_flight, self.in_flight_at = sent, time.time()
+        try:
+            await self.ws.send_str(sign_frame(payload_dict))
+        except Exception:
+            await self.ws.close()
+
+    async def ws_reader(self, ws):
+        try:
+            async for msg in ws:
+                if msg.type != aiohttp.WSMsgType.TEXT:
+                    continue
+                frame = json.loads(msg.data)
+                if frame.get("type") == "heartbeat":
+                    sent, self.in_flight = self.in_flight, None
+                    if sent is not None:
+                        handle_heartbeat_reply(frame, sent)
+                    if PENDING_RESULTS or PENDING_ACKS:
+                        self.wake.set()
+                elif frame.get("type") == "tasks":
+                    handle_tasks(frame.get("tasks", []))
+                    # stream the acks back right away
+                    self.wake.set()
+        except Exception as e:
+            logging.warning(f"WebSocket channel error: {e}")
+        logging.warning("WebSocket channel lost, using HTTP heartbeats.")
+        if self.ws is ws:
+            self.ws = None
+            if self.in_flight is not None:
+                heartbeat_failed()
+            self.in_flight = None
+            self.wake.set()
+
 
 def main():
     logging.info(f"Node Agent started. Target: {AGENT_BASE_URL}. Mode: {'DEBUG' if DEBUG_MODE else 'RELEASE'}")
     psutil.cpu_percent(interval=None)
+    if SUB_SAMPLING_ENABLED:
+        SUB_SAMPLER.start()
     get_external_ip()
-    
-    ssh_monitor = SSHMonitor()
+
+    if NODE_ASYNC and AIOHTTP_AVAILABLE:
+        logging.info("Running the asyncio agent.")
+        asyncio.run(AsyncAgent().run())
+        return
+
+    SSHMonitor().start(SEND_NOW.set)
+    COMMANDS.on_result = SEND_NOW.set
+    channel = NodeChannel() if WS_AVAILABLE and NODE_WS_ENABLED else None
 
     while True:
-        new_events = ssh_monitor.check()
-        if new_events:
-            logging.info(f"Found {len(new_events)} SSH login events.")
-            SSH_EVENTS.extend(new_events)
+        COMMANDS.poll()
+
+        if channel and channel.connected and channel.run_cycle(next_sleep_interval()):
+            send_backfill()
+            continue
 
+        SEND_NOW.clear()
         send_heartbeat()
-        time.sleep(UPDATE_INTERVAL)
+        send_backfill()
+        if channel and SERVER_WS_PATH:
+            channel.connect(SERVER_WS_PATH)
+        if not (channel and channel.connected):
+            SEND_NOW.wait(next_sleep_interval())
 
 if __name__ == "__main__":
     main()
\ No newline at end of file